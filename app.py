@@ -2,19 +2,43 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import hashlib
 import json
-from datetime import datetime
+import math
+import re
+import base64
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import wraps
 import dateutil.parser
 import babel
-from flask import Flask, abort, jsonify, render_template, request, Response, flash, redirect, url_for
+import click
+from flask import Flask, abort, g, jsonify, render_template, request, Response, flash, redirect, session, stream_with_context, url_for
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from werkzeug.http import is_resource_modified
+from markupsafe import Markup
+from sqlalchemy import DDL, and_, event, exc, func, literal, or_, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Load
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.dialects.postgresql import ARRAY
 from flask_migrate import Migrate
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
+from search import PrefixIndex, TagIndex, TrigramIndex
+from cache import create_cache
+from instrumentation import SQLInstrumentation
+from importer import BulkLoader, ImportKind, Reference
+from replicas import ReplicaRouter, RoutingSQLAlchemy, use_primary
+from pooling import PoolMonitor, engine_options
+from feed import ShowFeed
+from geo import Box, CentroidGeocoder, bounding_box, distance_km, grid_cell
 import sys
 
 #----------------------------------------------------------------------------#
@@ -24,82 +48,1897 @@ import sys
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app, engine_options=engine_options(app.config))
 migrate = Migrate(app, db)
+page_cache = create_cache(app.config)
+sql_instrumentation = SQLInstrumentation(app)
+replica_router = ReplicaRouter(app, db)
+pool_monitor = PoolMonitor(app, db)
+show_feed = ShowFeed(app, db)
+geocoder = CentroidGeocoder(app.config.get('GEO_CENTROIDS_PATH'))
 
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
+# SQLite only enforces foreign keys, and so ON DELETE CASCADE, when each
+# connection asks for it.
+@event.listens_for(Engine, 'connect')
+def enforce_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys = ON')
+
+
+GENRE_ARRAY = ARRAY(db.String)
+
+
+class GenreList(TypeDecorator):
+    # Postgres varchar[], stored as JSON on SQLite test and benchmark
+    # databases. Values compared with the column (@>, &&, =) are bound as
+    # varchar[] too; an untyped list reaches Postgres as text[], for which
+    # those operators do not exist.
+    impl = GENRE_ARRAY
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(db.JSON() if dialect.name == 'sqlite' else GENRE_ARRAY)
+
+    def coerce_compared_value(self, op, value):
+        return GENRE_ARRAY
+
+
+GENRES = GenreList()
+
 
 class Venue(db.Model):
     __tablename__ = 'venues'
+    __table_args__ = (
+        db.Index('ix_venues_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_venues_state_city', 'state', 'city'),
+        db.Index('ix_venues_grid', 'grid_y', 'grid_x'),
+        db.Index('ix_venues_genres', 'genres', postgresql_using='gin'),
+    )
     venue_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(ARRAY(db.String))
-    artists = db.relationship("Shows", cascade="all,delete", backref=db.backref("venues_from_artists", lazy="joined"))
+    genres = db.Column(GENRES)
+    # shows go with the venue through ON DELETE CASCADE (see Deletes)
+    artists = db.relationship("Shows", cascade="all,delete", passive_deletes=True, back_populates="venue")
     website = db.Column(db.String(500), nullable=True)
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean, nullable=True, default=False)
     seeking_description = db.Column(db.String(), nullable=True)
-    @classmethod
+    # maintained by maintain_show_counts and roll_show_counters
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped by every change to what the entity's page shows (see Versions)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=func.now())
+    # from the city centroid unless given, and its grid cell (see Geo)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    grid_y = db.Column(db.Integer, nullable=True)
+    grid_x = db.Column(db.Integer, nullable=True)
 
     def __repr__(self):
         return self.name
     @classmethod
     def past_shows(self, venue_id):
         venueId=venue_id
-        past_shows = db.session.query(Artist, Venue, Shows).join(Shows, Shows.artist_id == Artist.artist_id).join(Venue,Venue.venue_id==Shows.venue_id).filter(Shows.start_time < datetime.today(),Venue.venue_id ==venueId)
+        shows = show_history()
+        past_shows = show_tiles(shows).filter(shows.start_time < datetime.today(),Venue.venue_id ==venueId)
         return past_shows
 
     @classmethod
     def upcoming_shows(self, venue_id):
         venueId=venue_id
-        upcoming_shows = db.session.query(Artist, Venue, Shows).join(Shows, Shows.artist_id ==Artist.artist_id).join(Venue,Venue.venue_id==Shows.venue_id).filter(Shows.start_time > datetime.today(),Venue.venue_id ==venueId)
+        upcoming_shows = show_tiles().filter(Shows.start_time > datetime.today(),Venue.venue_id ==venueId)
         return upcoming_shows
 
+    @classmethod
+    def detail(cls, venue_id):
+        # venue plus every show, archived ones included, and its artist in a single round trip
+        shows = show_history()
+        rows = db.session.query(Venue, shows.start_time, shows.show_id, Artist.artist_id, Artist.name, Artist.image_link).\
+            outerjoin(shows, shows.venue_id == Venue.venue_id).\
+            outerjoin(Artist, Artist.artist_id == shows.artist_id).\
+            filter(Venue.venue_id == venue_id).order_by(shows.start_time).all()
+        if not rows:
+            return None
+        shows = [{'show_id': row[2], 'artist_id': row[3], 'artist_name': row[4], 'artist_image_link': row[5], 'start_time': row[1]}
+                 for row in rows if row[1] is not None]
+        return dict(split_shows(shows), venue=rows[0][0])
+
+class VenueArea(db.Model):
+    # one row per (state, city) that has venues, kept current by
+    # maintain_venue_areas so /venues can page through areas
+    __tablename__ = 'venue_areas'
+    state = db.Column(db.String(120), primary_key=True)
+    city = db.Column(db.String(120), primary_key=True)
+    venue_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class GenreFacet(db.Model):
+    # how many venues or artists per (state, seeking flag) carry each genre,
+    # kept current by maintain_genre_facets for the browse sidebars
+    __tablename__ = 'genre_facets'
+    entity = db.Column(db.String(10), primary_key=True)
+    state = db.Column(db.String(120), primary_key=True)
+    seeking = db.Column(db.Boolean, primary_key=True)
+    genre = db.Column(db.String(120), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Shows(db.Model):
     __tablename__ = 'shows'
+    __table_args__ = (
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_shows_start_time_show_id', 'start_time', 'show_id'),
+    )
+    # The partitioned table (migration 0a7d52c9e318) has the primary key
+    # (show_id, start_time), as Postgres requires of the partition key. The
+    # model keeps show_id alone: it is unique by itself, fed by one sequence
+    # for every partition, and SQLite only assigns ids to a lone INTEGER
+    # PRIMARY KEY. check-schema allows for exactly this difference.
     show_id = db.Column(db.Integer, primary_key=True)
-    artist_id = db.Column(db.Integer, db.ForeignKey('artists.artist_id'))
-    venue_id = db.Column(db.Integer, db.ForeignKey('venues.venue_id'))
-    start_time = db.Column(db.DateTime)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.artist_id', ondelete='CASCADE'))
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.venue_id', ondelete='CASCADE'))
+    start_time = db.Column(db.DateTime, nullable=False)
+    # minutes; a show books its venue from start_time to end_time
+    duration = db.Column(db.Integer, nullable=False, default=app.config['SHOW_DURATION'],
+                         server_default=str(app.config['SHOW_DURATION']))
     artist = db.relationship("Artist", back_populates="venues")
     venue = db.relationship("Venue", back_populates="artists")
 
+    @property
+    def end_time(self):
+        return self.start_time + timedelta(minutes=self.duration)
+
+
+# Postgres refuses overlapping bookings of one venue itself, so concurrent
+# submissions cannot both pass the check in book_show.
+event.listen(Shows.__table__, 'after_create', DDL(
+    "CREATE EXTENSION IF NOT EXISTS btree_gist; "
+    "ALTER TABLE shows ADD CONSTRAINT shows_venue_no_overlap EXCLUDE USING gist "
+    "(venue_id WITH =, tsrange(start_time, start_time + duration * interval '1 minute') WITH &&)"
+).execute_if(dialect='postgresql'))
+
+class ArchivedShow(db.Model):
+    # shows older than SHOW_ARCHIVE_AFTER_DAYS, moved here by archive-shows
+    __tablename__ = 'shows_archive'
+    __table_args__ = (
+        db.Index('ix_shows_archive_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_archive_artist_id_start_time', 'artist_id', 'start_time'),
+    )
+    show_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.artist_id', ondelete='CASCADE'))
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.venue_id', ondelete='CASCADE'))
+    start_time = db.Column(db.DateTime)
+    duration = db.Column(db.Integer, nullable=False)
+
+
+def show_history_table():
+    columns = ('show_id', 'artist_id', 'venue_id', 'start_time', 'duration')
+    return db.union_all(*[db.select([table.c[name] for name in columns])
+                          for table in (Shows.__table__, ArchivedShow.__table__)]).alias('show_history')
+
+
+def show_history():
+    # hot and archived shows as one Shows entity. Queries reaching into the
+    # past go through it; upcoming ones stay on Shows and its hot partitions.
+    return db.aliased(Shows, show_history_table(), name='Shows')
+
+
 class Artist(db.Model):
     __tablename__ = 'artists'
+    __table_args__ = (
+        db.Index('ix_artists_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_artists_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_artists_state_city', 'state', 'city'),
+    )
     artist_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(ARRAY(db.String))
+    genres = db.Column(GENRES)
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, nullable=True, default=False)
     seeking_description = db.Column(db.String(), nullable=True)
-    venues = db.relationship("Shows", cascade="all,delete", backref=db.backref('artists_from_venues', lazy='joined'))
+    # shows go with the artist through ON DELETE CASCADE (see Deletes)
+    venues = db.relationship("Shows", cascade="all,delete", passive_deletes=True, back_populates="artist")
+    # maintained by maintain_show_counts and roll_show_counters
+    upcoming_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    show_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped by every change to what the entity's page shows (see Versions)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=func.now())
     def __repr__(self):
         return self.name
     @classmethod
     def past_shows(self, artist_id):
         artistId=artist_id
-        past_shows = db.session.query(Artist, Venue, Shows).join(Shows, Shows.artist_id == Artist.artist_id).join(Venue,Venue.venue_id==Shows.venue_id).filter(Shows.start_time < datetime.today(), Artist.artist_id ==artistId)
+        shows = show_history()
+        past_shows = show_tiles(shows).filter(shows.start_time < datetime.today(), Artist.artist_id ==artistId)
         return past_shows
 
     @classmethod
     def upcoming_shows(self, artist_id):
         artistId=artist_id
-        upcoming_shows = db.session.query(Artist, Venue, Shows).join(Shows, Shows.artist_id ==Artist.artist_id).join(Venue,Venue.venue_id==Shows.venue_id).filter(Shows.start_time > datetime.today(),Artist.artist_id ==artistId)
+        upcoming_shows = show_tiles().filter(Shows.start_time > datetime.today(),Artist.artist_id ==artistId)
         return upcoming_shows
 
+    @classmethod
+    def detail(cls, artist_id):
+        # artist plus every show, archived ones included, and its venue in a single round trip
+        shows = show_history()
+        rows = db.session.query(Artist, shows.start_time, shows.show_id, Venue.venue_id, Venue.name, Venue.image_link).\
+            outerjoin(shows, shows.artist_id == Artist.artist_id).\
+            outerjoin(Venue, Venue.venue_id == shows.venue_id).\
+            filter(Artist.artist_id == artist_id).order_by(shows.start_time).all()
+        if not rows:
+            return None
+        shows = [{'show_id': row[2], 'venue_id': row[3], 'venue_name': row[4], 'venue_image_link': row[5], 'start_time': row[1]}
+                 for row in rows if row[1] is not None]
+        return dict(split_shows(shows), artist=rows[0][0])
+
+
+class CounterWatermark(db.Model):
+    # the show counters count shows starting after value as upcoming
+    __tablename__ = 'counter_watermarks'
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.DateTime, nullable=False)
+
+
+class Match(db.Model):
+    # a venue seeking talent and an artist seeking venues in the same state
+    # with genres in common, kept current by maintain_matches
+    __tablename__ = 'matches'
+    __table_args__ = (
+        db.Index('ix_matches_venue_id_score', 'venue_id', 'score'),
+        db.Index('ix_matches_artist_id_score', 'artist_id', 'score'),
+    )
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.venue_id', ondelete='CASCADE'), primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.artist_id', ondelete='CASCADE'), primary_key=True)
+    shared_genres = db.Column(GENRES, nullable=False)
+    same_city = db.Column(db.Boolean, nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+
+
+def by_activity(model):
+    # most upcoming shows first; negated so keyset_page can page ascending
+    return [-model.upcoming_show_count, -model.show_count, model.name, db.inspect(model).primary_key[0]]
+
+
+db.Index('ix_venues_activity', *by_activity(Venue))
+db.Index('ix_artists_activity', *by_activity(Artist))
+
+
+# Named loading profiles. Nothing is eager-loaded by default; each route asks
+# for the cheapest profile that has what it renders: 'list' for listing and
+# search pages, 'tile' for show tiles, 'map' for venues near a place, 'edit' for forms and writes (the
+# entity's own columns). Detail pages use Venue.detail/Artist.detail, which
+# fetch the entity and its shows in one query.
+LOADING_PROFILES = {
+    Venue: {
+        'list': lambda: [Load(Venue).load_only('venue_id', 'name', 'city', 'state', 'upcoming_show_count', 'show_count',
+                                               'version', 'updated_at')],
+        'tile': lambda: [Load(Venue).load_only('venue_id', 'name', 'image_link')],
+        'map': lambda: [Load(Venue).load_only('venue_id', 'name', 'city', 'state', 'image_link', 'latitude', 'longitude')],
+        'edit': lambda: [Load(Venue).lazyload('*')],
+    },
+    Artist: {
+        'list': lambda: [Load(Artist).load_only('artist_id', 'name', 'city', 'state', 'upcoming_show_count', 'show_count',
+                                                'version', 'updated_at')],
+        'tile': lambda: [Load(Artist).load_only('artist_id', 'name', 'image_link')],
+        'edit': lambda: [Load(Artist).lazyload('*')],
+    },
+    Shows: {
+        'tile': lambda: [Load(Shows).load_only('show_id', 'start_time', 'artist_id', 'venue_id')],
+    },
+}
+
+
+def loading(model, profile):
+    return LOADING_PROFILES[model][profile]()
+
+
+def profiled(model, profile):
+    return model.query.options(*loading(model, profile))
+
+
+def show_tiles(shows=Shows):
+    options = loading(Artist, 'tile') + loading(Venue, 'tile') + (loading(Shows, 'tile') if shows is Shows else [])
+    return db.session.query(Artist, Venue, shows).join(shows, shows.artist_id ==Artist.artist_id).join(Venue,Venue.venue_id==shows.venue_id).\
+        options(*options)
+
+
+def split_shows(shows, now=None):
+    # shows must already be ordered by start_time
+    now = now or datetime.today()
+    upcoming = [show for show in shows if show['start_time'] > now]
+    past = [show for show in shows if show['start_time'] < now]
+    return {
+        'upcoming_shows': upcoming,
+        'upcoming_shows_count': len(upcoming),
+        'past_shows': past,
+        'past_shows_count': len(past),
+    }
+
+
+
+#----------------------------------------------------------------------------#
+# Change hooks.
+#----------------------------------------------------------------------------#
+
+# Callbacks registered with on_commit(Model) receive (operation, values) for
+# every row of that model written by a transaction, once it has committed.
+# Values are snapshotted at flush time because a committed session can no
+# longer load expired attributes.
+#
+# Callbacks registered with on_flush(Model) receive (session, operation,
+# values, previous) while the transaction is still open, so the SQL they run
+# to keep derived tables in step commits or rolls back with the write.
+# previous holds the old value of every column an update changed.
+commit_hooks = {}
+flush_hooks = {}
+
+
+def on_commit(model):
+    def register(fn):
+        commit_hooks.setdefault(model, []).append(fn)
+        return fn
+    return register
+
+
+def on_flush(model):
+    def register(fn):
+        if model not in flush_hooks:
+            keep_previous_values(model)
+        flush_hooks.setdefault(model, []).append(fn)
+        return fn
+    return register
+
+
+def keep_previous_values(model):
+    # without active history, overwriting an expired attribute records no
+    # old value and previous would miss the change
+    for column in db.inspect(model).column_attrs:
+        event.listen(column.class_attribute, 'set', lambda target, value, oldvalue, initiator: None, active_history=True)
+
+
+def snapshot(obj):
+    return {column.key: getattr(obj, column.key) for column in db.inspect(obj).mapper.column_attrs}
+
+
+def previous_values(obj):
+    state = db.inspect(obj)
+    previous = {}
+    for column in state.mapper.column_attrs:
+        history = state.attrs[column.key].history
+        if history.deleted:
+            previous[column.key] = history.deleted[0]
+    return previous
+
+
+@event.listens_for(db.session, 'after_flush')
+def record_changes(session, flush_context):
+    changes = session.info.setdefault('changes', [])
+    for operation, objs in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objs:
+            model = type(obj)
+            if model not in commit_hooks and model not in flush_hooks:
+                continue
+            if operation == 'update' and not session.is_modified(obj):
+                continue
+            values = snapshot(obj)
+            previous = previous_values(obj) if operation == 'update' else {}
+            for fn in flush_hooks.get(model, ()):
+                fn(session, operation, values, previous)
+            if model in commit_hooks:
+                changes.append((model, operation, values))
+
+
+def record_bulk_changes(session, model, operation, rows):
+    # runs the hooks for rows written with Core statements, which the ORM
+    # does not see; rows are dicts of column values
+    for values in rows:
+        for fn in flush_hooks.get(model, ()):
+            fn(session, operation, values, {})
+        if model in commit_hooks:
+            session.info.setdefault('changes', []).append((model, operation, values))
+
+
+@event.listens_for(db.session, 'after_commit')
+def run_commit_hooks(session):
+    for model, operation, values in session.info.pop('changes', []):
+        for fn in commit_hooks.get(model, ()):
+            try:
+                fn(operation, values)
+            except Exception:
+                app.logger.exception('commit hook %s failed', fn.__name__)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_changes(session, previous_transaction):
+    session.info.pop('changes', None)
+    session.info.pop('released', None)
+    session.info.pop('stale_pages', None)
+
+
+#----------------------------------------------------------------------------#
+# Bookings.
+#----------------------------------------------------------------------------#
+
+# A show lasts at most MAX_SHOW_DURATION minutes, so every booking that can
+# overlap [start, end) starts within [start - MAX_SHOW_DURATION, end). That
+# bounds the ix_shows_venue_id_start_time range scan to a few rows.
+
+class BookingConflict(Exception):
+    pass
+
+
+class InvalidBooking(ValueError):
+    pass
+
+
+def bookings(venue_id, start, end, exclude_show_id=None):
+    earliest = start - timedelta(minutes=app.config['MAX_SHOW_DURATION'])
+    query = db.session.query(Shows.show_id, Shows.start_time, Shows.duration).\
+        filter(Shows.venue_id == venue_id, Shows.start_time > earliest, Shows.start_time < end)
+    if exclude_show_id is not None:
+        query = query.filter(Shows.show_id != exclude_show_id)
+    booked = []
+    for show_id, show_start, duration in query.order_by(Shows.start_time):
+        show_end = show_start + timedelta(minutes=duration)
+        if show_end > start:
+            booked.append((show_id, show_start, show_end))
+    return booked
+
+
+def check_booking(start_time, duration, booked):
+    # the rules every way of booking a show enforces; booked(start, end)
+    # returns the venue's bookings overlapping [start, end)
+    if not duration or not 0 < duration <= app.config['MAX_SHOW_DURATION']:
+        raise InvalidBooking('Duration must be between 1 and %d minutes.' % app.config['MAX_SHOW_DURATION'])
+    overlapping = booked(start_time, start_time + timedelta(minutes=duration))
+    if overlapping:
+        raise BookingConflict(overlapping[0])
+
+
+def book_show(artist_id, venue_id, start_time, duration):
+    check_booking(start_time, duration, lambda start, end: bookings(venue_id, start, end))
+    show = Shows(artist_id=int(artist_id), venue_id=int(venue_id), start_time=start_time, duration=duration)
+    db.session.add(show)
+    try:
+        db.session.commit()
+    except exc.IntegrityError as error:
+        db.session.rollback()
+        if 'venue_no_overlap' in str(error.orig):
+            raise BookingConflict(None)
+        raise
+    return show
+
+
+def check_imported_shows(rows):
+    # book_show's rules for a batch of import-data rows: one query fetches
+    # the bookings that could overlap any of them, and each accepted row
+    # counts as booked for the rows after it. Yields errors or None per row.
+    near = {}
+    if rows:
+        reach = timedelta(minutes=app.config['MAX_SHOW_DURATION'])
+        query = db.session.query(Shows.venue_id, Shows.show_id, Shows.start_time, Shows.duration).filter(
+            Shows.venue_id.in_(set(row['venue_id'] for row in rows)),
+            Shows.start_time > min(row['start_time'] for row in rows) - reach,
+            Shows.start_time < max(row['start_time'] for row in rows) + reach)
+        for venue_id, show_id, start, duration in query:
+            near.setdefault(venue_id, []).append((show_id, start, start + timedelta(minutes=duration)))
+    for row in rows:
+        # as in create_show_submission, no duration means the default
+        if row['duration'] is None:
+            row['duration'] = app.config['SHOW_DURATION']
+        booked = near.setdefault(row['venue_id'], [])
+        try:
+            check_booking(row['start_time'], row['duration'],
+                          lambda start, end: [booking for booking in booked if booking[1] < end and booking[2] > start])
+        except InvalidBooking as reason:
+            yield {'duration': [str(reason)]}
+            continue
+        except BookingConflict as conflict:
+            show_id, start, end = conflict.args[0]
+            yield {'start_time': ['venue is already booked from %s to %s' % (start, end)]}
+            continue
+        booked.append((row.get('show_id'), row['start_time'], row['start_time'] + timedelta(minutes=row['duration'])))
+        yield None
+
+
+def free_slots(venue_id, start, end, min_minutes=0):
+    # gaps of at least min_minutes between the bookings inside [start, end)
+    slots = []
+    cursor = start
+    for show_id, show_start, show_end in bookings(venue_id, start, end):
+        if show_start - cursor >= timedelta(minutes=max(min_minutes, 1)):
+            slots.append((cursor, show_start))
+        cursor = max(cursor, show_end)
+    if end - cursor >= timedelta(minutes=max(min_minutes, 1)):
+        slots.append((cursor, end))
+    return slots
+
+
+#----------------------------------------------------------------------------#
+# Archive.
+#----------------------------------------------------------------------------#
+
+# On Postgres the shows table may be range partitioned by month on
+# start_time (migration 0a7d52c9e318), with a shows_default partition for
+# anything outside the monthly ones. Shows older than SHOW_ARCHIVE_AFTER_DAYS
+# move to shows_archive and their emptied partitions are dropped, so hot
+# queries only touch recent and future months. Exclusion constraints cannot
+# span partitions, so each partition carries its own.
+
+PARTITION_NAME = re.compile(r'^shows_y(\d{4})m(\d{2})$')
+
+
+def show_partitions_enabled():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('shows')").first() is not None
+
+
+def show_partitions():
+    rows = db.session.execute("SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                              "WHERE pg_inherits.inhparent = 'shows'::regclass")
+    partitions = {}
+    for name, in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def ensure_show_partitions(months_ahead):
+    # creates the monthly partitions up to months_ahead from now, moving any
+    # rows for those months out of shows_default first so ATTACH succeeds
+    existing = show_partitions()
+    month = datetime(datetime.today().year, datetime.today().month, 1)
+    created = []
+    for _ in range(months_ahead + 1):
+        if month not in existing:
+            name = 'shows_y%04dm%02d' % (month.year, month.month)
+            bounds = {'start': month, 'end': next_month(month)}
+            db.session.execute('CREATE TABLE %s (LIKE shows INCLUDING DEFAULTS INCLUDING CONSTRAINTS)' % name)
+            db.session.execute('WITH moved AS (DELETE FROM shows_default WHERE start_time >= :start AND start_time < :end '
+                               'RETURNING *) INSERT INTO %s SELECT * FROM moved' % name, bounds)
+            db.session.execute("ALTER TABLE shows ATTACH PARTITION %s FOR VALUES FROM ('%s') TO ('%s')" % (
+                name, bounds['start'].isoformat(), bounds['end'].isoformat()))
+            db.session.execute("ALTER TABLE %s ADD CONSTRAINT %s_venue_no_overlap EXCLUDE USING gist "
+                               "(venue_id WITH =, tsrange(start_time, start_time + duration * interval '1 minute') WITH &&)" % (name, name))
+            db.session.commit()
+            created.append(name)
+        month = next_month(month)
+    return created
+
+
+def archive_shows(before, batch_size):
+    # bulk moves bypass the change hooks on purpose: archived shows still
+    # render on venue and artist pages, so no cached page goes stale
+    shows, archive = Shows.__table__, ArchivedShow.__table__
+    columns = [column.name for column in archive.columns]
+    moved = 0
+    while True:
+        ids = [row[0] for row in db.session.query(Shows.show_id).filter(Shows.start_time < before).
+               order_by(Shows.start_time).limit(batch_size)]
+        if not ids:
+            break
+        db.session.execute(archive.insert().from_select(columns, db.select([shows.c[name] for name in columns]).
+                                                        where(shows.c.show_id.in_(ids))))
+        db.session.execute(shows.delete().where(shows.c.show_id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+    return moved
+
+
+def drop_archived_partitions(before):
+    dropped = []
+    for month, name in sorted(show_partitions().items()):
+        if next_month(month) <= before and db.session.execute('SELECT 1 FROM %s LIMIT 1' % name).first() is None:
+            db.session.execute('DROP TABLE %s' % name)
+            dropped.append(name)
+    db.session.commit()
+    return dropped
+
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+# venues and artists carry upcoming_show_count, past_show_count and
+# show_count. Shows starting after the 'shows' watermark count as upcoming;
+# roll-show-counters moves the shows that started since the last run from
+# upcoming to past and advances the watermark. Show writes adjust the
+# counters in their own transaction, classified against the same watermark,
+# and hold a share lock on it so a roll-over cannot interleave.
+
+COUNTED = ((Venue, 'venue_id'), (Artist, 'artist_id'))
+
+
+def counters_watermark(connection, lock=False):
+    watermarks = CounterWatermark.__table__
+    query = db.select([watermarks.c.value]).where(watermarks.c.name == 'shows')
+    if connection.dialect.name == 'postgresql':
+        query = query.with_for_update(read=not lock)
+    value = connection.execute(query).scalar()
+    if value is None:
+        # a fresh database: every counter is still zero
+        value = datetime.today()
+        connection.execute(watermarks.insert().values(name='shows', value=value))
+    return value
+
+
+def adjust_show_counts(connection, keys, upcoming, delta):
+    # keys maps venue_id / artist_id to the id whose counters change
+    column = 'upcoming_show_count' if upcoming else 'past_show_count'
+    for model, key in COUNTED:
+        if keys.get(key) is None:
+            continue
+        table = model.__table__
+        connection.execute(table.update().where(table.c[key] == keys[key]).values(
+            {column: table.c[column] + delta, 'show_count': table.c.show_count + delta}, **new_version(table)))
+
+
+def is_upcoming(start_time, watermark):
+    return start_time is not None and start_time > watermark
+
+
+@on_flush(Shows)
+def maintain_show_counts(session, operation, values, previous):
+    if operation == 'update' and not set(previous) & {'venue_id', 'artist_id', 'start_time'}:
+        return
+    connection = session.connection()
+    watermark = counters_watermark(connection)
+    if operation != 'insert':
+        old = dict(values, **previous)
+        adjust_show_counts(connection, old, is_upcoming(old['start_time'], watermark), -1)
+    if operation != 'delete':
+        adjust_show_counts(connection, values, is_upcoming(values['start_time'], watermark), 1)
+
+
+def roll_show_counters():
+    connection = db.session.connection()
+    rolled_from = counters_watermark(connection, lock=True)
+    rolled_to = datetime.today()
+    moved = 0
+    for model, key in COUNTED:
+        table = model.__table__
+        started = db.session.query(getattr(Shows, key), func.count()).\
+            filter(Shows.start_time > rolled_from, Shows.start_time <= rolled_to).group_by(getattr(Shows, key))
+        for owner, count in started:
+            connection.execute(table.update().where(table.c[key] == owner).values(
+                upcoming_show_count=table.c.upcoming_show_count - count, past_show_count=table.c.past_show_count + count,
+                **new_version(table)))
+            if model is Venue:
+                moved += count
+    watermarks = CounterWatermark.__table__
+    connection.execute(watermarks.update().where(watermarks.c.name == 'shows').values(value=rolled_to))
+    db.session.commit()
+    return moved
+
+
+def refresh_show_counters():
+    connection = db.session.connection()
+    watermark = counters_watermark(connection, lock=True)
+    history = show_history_table()
+    for model, key in COUNTED:
+        table = model.__table__
+        owned = history.c[key] == table.c[key]
+        count = lambda *criteria: db.select([func.count()]).select_from(history).where(and_(owned, *criteria)).as_scalar()
+        connection.execute(table.update().values(upcoming_show_count=count(history.c.start_time > watermark),
+                                                 past_show_count=count(history.c.start_time <= watermark),
+                                                 show_count=count()))
+    db.session.commit()
+
+
+#----------------------------------------------------------------------------#
+# Versions.
+#----------------------------------------------------------------------------#
+
+# A venue's or artist's version and updated_at change with anything its page
+# shows: its own columns, its shows (through the show counters above) and
+# the names and images of the artists or venues it shares shows with. They
+# are the page's ETag and Last-Modified (see Caching).
+
+def new_version(table):
+    return {'version': table.c.version + 1, 'updated_at': datetime.utcnow()}
+
+
+def bump_version(mapper, connection, target):
+    # a SQL expression, so concurrent edits never compute the same version
+    if db.object_session(target).is_modified(target, include_collections=False):
+        for key, value in new_version(mapper.local_table).items():
+            setattr(target, key, value)
+
+
+event.listen(Venue, 'before_update', bump_version)
+event.listen(Artist, 'before_update', bump_version)
+
+
+# what a venue's or artist's counterparts show of it
+LABEL_COLUMNS = {'name', 'image_link'}
+
+
+def maintain_counterpart_versions(model, key, other, other_key):
+    @on_flush(model)
+    def bump_counterpart_versions(session, operation, values, previous):
+        if operation != 'update' or not LABEL_COLUMNS & set(previous):
+            return
+        history = show_history_table()
+        table = other.__table__
+        hosted = db.select([history.c[other_key]]).where(history.c[key] == values[key])
+        session.connection().execute(table.update().where(table.c[other_key].in_(hosted)).values(**new_version(table)))
+
+
+maintain_counterpart_versions(Venue, 'venue_id', Artist, 'artist_id')
+maintain_counterpart_versions(Artist, 'artist_id', Venue, 'venue_id')
+
+
+#----------------------------------------------------------------------------#
+# Venue areas.
+#----------------------------------------------------------------------------#
+
+# venue_areas counts the venues in each (state, city). Venue writes adjust it
+# in the same transaction, so the /venues page pages through areas and only
+# loads the venues of the areas it shows. Venues without a city or state are
+# counted under ''.
+
+def area_key(values):
+    return values.get('state') or '', values.get('city') or ''
+
+
+def adjust_counter(connection, table, keys, column, delta):
+    # add delta to the counter row identified by keys, creating it on first
+    # use and dropping it once it reaches zero
+    counter = table.c[column]
+    if delta > 0 and connection.dialect.name == 'postgresql':
+        connection.execute(postgresql.insert(table).values(dict(keys, **{column: delta})).
+                           on_conflict_do_update(index_elements=list(keys), set_={column: counter + delta}))
+        return
+    row = and_(*[table.c[key] == value for key, value in keys.items()])
+    updated = connection.execute(table.update().where(row).values({column: counter + delta}))
+    if delta > 0 and updated.rowcount == 0:
+        connection.execute(table.insert().values(dict(keys, **{column: delta})))
+    elif delta < 0:
+        connection.execute(table.delete().where(and_(row, counter <= 0)))
+
+
+def adjust_area(connection, state, city, delta):
+    adjust_counter(connection, VenueArea.__table__, {'state': state, 'city': city}, 'venue_count', delta)
+
+
+@on_flush(Venue)
+def maintain_venue_areas(session, operation, values, previous):
+    connection = session.connection()
+    if operation == 'insert':
+        adjust_area(connection, *area_key(values), delta=1)
+    elif operation == 'delete':
+        adjust_area(connection, *area_key(values), delta=-1)
+    elif 'state' in previous or 'city' in previous:
+        adjust_area(connection, *area_key(dict(values, **previous)), delta=-1)
+        adjust_area(connection, *area_key(values), delta=1)
+
+
+def refresh_venue_areas():
+    areas = VenueArea.__table__
+    state, city = func.coalesce(Venue.state, ''), func.coalesce(Venue.city, '')
+    db.session.execute(areas.delete())
+    db.session.execute(areas.insert().from_select(['state', 'city', 'venue_count'],
+                                                  db.select([state, city, func.count()]).group_by(state, city)))
+    db.session.commit()
+
+
+#----------------------------------------------------------------------------#
+# Genres.
+#----------------------------------------------------------------------------#
+
+# Genre filters use array containment (genres @> ARRAY[...]) served by GIN
+# indexes on Postgres, and an in-process TagIndex elsewhere. genre_facets
+# holds the sidebar counts per entity, state, seeking flag and genre; writes
+# adjust it in the same transaction, so the sidebar never aggregates the
+# venues or artists tables.
+GENRE_ENTITIES = {Venue: ('venues', 'venue_id', 'seeking_talent'), Artist: ('artists', 'artist_id', 'seeking_venue')}
+genre_indexes = {Venue: TagIndex(), Artist: TagIndex()}
+# Per-connection scratch tables holding the keys the index matched, so the
+# SQLite filter is a subquery rather than one bound parameter per key.
+genre_hits = {model: db.Table('genre_hits_%s' % entity, db.MetaData(), db.Column('key', db.Integer, primary_key=True),
+                              prefixes=['TEMPORARY'])
+              for model, (entity, pk, seeking) in GENRE_ENTITIES.items()}
+
+
+def has_array_support():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def facet_keys(model, values):
+    entity, pk, seeking = GENRE_ENTITIES[model]
+    return set((entity, values.get('state') or '', bool(values.get(seeking)), genre) for genre in values.get('genres') or ())
+
+
+def adjust_facets(connection, keys, delta):
+    for entity, state, seeking, genre in keys:
+        adjust_counter(connection, GenreFacet.__table__, {'entity': entity, 'state': state, 'seeking': seeking, 'genre': genre},
+                       'count', delta)
+
+
+def maintain_genre_facets(model):
+    @on_flush(model)
+    def adjust_genre_facets(session, operation, values, previous):
+        new = facet_keys(model, values) if operation != 'delete' else set()
+        old = facet_keys(model, dict(values, **previous)) if operation != 'insert' else set()
+        adjust_facets(session.connection(), old - new, -1)
+        adjust_facets(session.connection(), new - old, 1)
+
+    @on_commit(model)
+    def update_genre_index(operation, values):
+        index = genre_indexes[model]
+        if not index.loaded:
+            return
+        pk = GENRE_ENTITIES[model][1]
+        if operation == 'delete':
+            index.discard(values[pk])
+        else:
+            index.add(values[pk], values.get('genres'))
+
+
+maintain_genre_facets(Venue)
+maintain_genre_facets(Artist)
+
+
+def refresh_genre_facets():
+    counts = {}
+    for model, (entity, pk, seeking) in GENRE_ENTITIES.items():
+        for state, seeking_flag, genres in db.session.query(model.state, getattr(model, seeking), model.genres).yield_per(1000):
+            for key in facet_keys(model, {'state': state, seeking: seeking_flag, 'genres': genres}):
+                counts[key] = counts.get(key, 0) + 1
+    facets = GenreFacet.__table__
+    db.session.execute(facets.delete())
+    if counts:
+        db.session.execute(facets.insert(), [{'entity': entity, 'state': state, 'seeking': seeking, 'genre': genre, 'count': count}
+                                             for (entity, state, seeking, genre), count in counts.items()])
+    db.session.commit()
+
+
+def with_genres(model, genres):
+    if has_array_support():
+        return model.genres.contains(literal(sorted(genres), GENRE_ARRAY))
+    index = genre_indexes[model]
+    pk = db.inspect(model).primary_key[0]
+    if not index.loaded:
+        index.load(db.session.query(pk, model.genres).all())
+    hits = genre_hits[model]
+    connection = db.session.connection()
+    hits.create(connection, checkfirst=True)
+    connection.execute(hits.delete())
+    keys = index.containing(genres)
+    if keys:
+        connection.execute(hits.insert(), [{'key': key} for key in keys])
+    return pk.in_(db.select([hits.c.key]))
+
+
+def genre_facets(model, state=None, seeking=None):
+    entity = GENRE_ENTITIES[model][0]
+    query = db.session.query(GenreFacet.genre, func.sum(GenreFacet.count)).filter(GenreFacet.entity == entity)
+    if state:
+        query = query.filter(GenreFacet.state == state)
+    if seeking is not None:
+        query = query.filter(GenreFacet.seeking == seeking)
+    return query.group_by(GenreFacet.genre).order_by(func.sum(GenreFacet.count).desc(), GenreFacet.genre).all()
+
+
+def browse(model, title):
+    entity, pk, seeking_column = GENRE_ENTITIES[model]
+    genres = request.args.getlist('genre')
+    state = request.args.get('state') or None
+    seeking = {'1': True, '0': False}.get(request.args.get('seeking'))
+    term = request.args.get('q', '').strip()
+    query = profiled(model, 'list')
+    if genres:
+        query = query.filter(with_genres(model, genres))
+    if state:
+        query = query.filter(model.state == state)
+    if seeking is not None:
+        query = query.filter(getattr(model, seeking_column) == seeking)
+    if term:
+        if has_trigram_support():
+            query = query.filter(name_matches(model.name, term))
+        else:
+            query = query.filter(getattr(model, pk).in_([key for key, score in index_search(model, term, None)]))
+    key_column = getattr(model, pk)
+    page = keyset_page(query, [model.name, key_column], lambda row: (row.name, getattr(row, pk)))
+    facets = genre_facets(model, state, seeking)
+    return conditional_render(listing_validators(page.items, facets), lambda: render_template(
+        'pages/browse.html', title=title, entity=entity, results=page.items, page=page,
+        facets=facets, genres=genres, state=state, seeking=seeking,
+        term=term, states=[value for value, label in VenueForm.state.kwargs['choices']]))
+
+
+def in_area(model, area):
+    # '' stands for venues without a state or city
+    def matches(column, value):
+        return column == value if value else or_(column.is_(None), column == '')
+    return and_(matches(model.state, area.state), matches(model.city, area.city))
+
+
+def venue_areas_page(activity=False):
+    page = keyset_page(VenueArea.query, [VenueArea.state, VenueArea.city], lambda area: (area.state, area.city))
+    areas = [{'state': area.state, 'city': area.city, 'venues': [], 'upcoming_shows': 0} for area in page.items]
+    if not areas:
+        return page, areas
+    by_key = {(area['state'], area['city']): area for area in areas}
+    in_page = or_(*[in_area(Venue, area) for area in page.items])
+    order = by_activity(Venue) if activity else [Venue.name, Venue.venue_id]
+    for venue in profiled(Venue, 'list').filter(in_page).order_by(*order):
+        area = by_key[area_key({'state': venue.state, 'city': venue.city})]
+        area['venues'].append(venue)
+        area['upcoming_shows'] += venue.upcoming_show_count
+    return page, areas
+
+
+#----------------------------------------------------------------------------#
+# Matches.
+#----------------------------------------------------------------------------#
+
+# matches pairs each venue seeking talent with each artist seeking venues in
+# the same state that shares at least one of its genres. score is the number
+# of shared genres plus MATCH_SAME_CITY_BONUS for the same city. A write that
+# changes a venue's or artist's seeking flag, genres, city or state
+# recomputes its rows in the same transaction, looking only at seeking
+# counterparts in its state (with overlapping genres, on Postgres).
+MATCH_SIDES = {
+    Venue: ('venue_id', 'seeking_talent', Artist, 'artist_id', 'seeking_venue'),
+    Artist: ('artist_id', 'seeking_venue', Venue, 'venue_id', 'seeking_talent'),
+}
+
+
+def same_city(left, right):
+    return bool((left or '').strip()) and left.strip().lower() == (right or '').strip().lower()
+
+
+def match_row(venue_id, artist_id, venue_city, artist_city, shared):
+    close = same_city(venue_city, artist_city)
+    return {'venue_id': venue_id, 'artist_id': artist_id, 'shared_genres': sorted(shared), 'same_city': close,
+            'score': len(shared) + (app.config['MATCH_SAME_CITY_BONUS'] if close else 0)}
+
+
+def compute_matches(connection, model, values):
+    key, seeking, other, other_key, other_seeking = MATCH_SIDES[model]
+    genres = set(values.get('genres') or ())
+    if not values.get(seeking) or not genres or not values.get('state'):
+        return []
+    table = other.__table__
+    query = db.select([table.c[other_key], table.c.city, table.c.genres]).\
+        where(and_(table.c[other_seeking].is_(True), table.c.state == values['state']))
+    if connection.dialect.name == 'postgresql':
+        query = query.where(table.c.genres.overlap(literal(sorted(genres), GENRE_ARRAY)))
+    rows = []
+    for other_id, city, other_genres in connection.execute(query):
+        shared = genres & set(other_genres or ())
+        if not shared:
+            continue
+        if model is Venue:
+            rows.append(match_row(values[key], other_id, values.get('city'), city, shared))
+        else:
+            rows.append(match_row(other_id, values[key], city, values.get('city'), shared))
+    return rows
+
+
+def maintain_matches(model):
+    key, seeking = MATCH_SIDES[model][:2]
+
+    @on_flush(model)
+    def recompute_matches(session, operation, values, previous):
+        if operation == 'update' and not {seeking, 'genres', 'city', 'state'} & set(previous):
+            return
+        connection = session.connection()
+        matches = Match.__table__
+        # also on insert: a counterpart inserted earlier in the same flush
+        # may already have paired itself with this row
+        connection.execute(matches.delete().where(matches.c[key] == values[key]))
+        rows = compute_matches(connection, model, values) if operation != 'delete' else []
+        if rows:
+            connection.execute(matches.insert(), rows)
+
+
+maintain_matches(Venue)
+maintain_matches(Artist)
+
+
+def refresh_matches():
+    # rebuild every match, pairing venues and artists state by state through
+    # a genre -> artists map
+    seeking = {}
+    for model, (key, flag, other, other_key, other_flag) in MATCH_SIDES.items():
+        query = db.session.query(getattr(model, key), model.state, model.city, model.genres).\
+            filter(getattr(model, flag).is_(True))
+        for entity_id, state, city, genres in query.yield_per(1000):
+            if state and genres:
+                seeking.setdefault((model, state), []).append((entity_id, city, set(genres)))
+    rows = []
+    for (model, state), venues in seeking.items():
+        if model is not Venue:
+            continue
+        by_genre = {}
+        for artist in seeking.get((Artist, state), ()):
+            for genre in artist[2]:
+                by_genre.setdefault(genre, []).append(artist)
+        for venue_id, venue_city, venue_genres in venues:
+            candidates = {artist[0]: artist for genre in venue_genres for artist in by_genre.get(genre, ())}
+            rows += [match_row(venue_id, artist_id, venue_city, artist_city, venue_genres & artist_genres)
+                     for artist_id, artist_city, artist_genres in candidates.values()]
+    matches = Match.__table__
+    db.session.execute(matches.delete())
+    for start in range(0, len(rows), 5000):
+        db.session.execute(matches.insert(), rows[start:start + 5000])
+    db.session.commit()
+    return len(rows)
+
+
+def matches_for(model, entity_id, same_city_only=False, limit=None):
+    # best matches first: (match, counterpart id, name, city, state, image_link)
+    key, seeking, other, other_key, other_seeking = MATCH_SIDES[model]
+    other_pk = getattr(other, other_key)
+    query = db.session.query(Match, other_pk, other.name, other.city, other.state, other.image_link).\
+        join(other, other_pk == getattr(Match, other_key)).filter(getattr(Match, key) == entity_id)
+    if same_city_only:
+        query = query.filter(Match.same_city.is_(True))
+    return query.order_by(Match.score.desc(), other.name, other_pk).limit(limit).all()
+
+
+#----------------------------------------------------------------------------#
+# Geo.
+#----------------------------------------------------------------------------#
+
+# Venues are placed at their city's centroid by the offline geocoder unless
+# latitude and longitude are set explicitly, and bucketed into grid cells
+# (geo.GRID_DEGREES) under ix_venues_grid. Box and radius searches read the
+# cells the box covers; nearest-venue searches widen the radius until they
+# have enough venues or reach GEO_MAX_RADIUS_KM.
+
+def locate_venue(mapper, connection, target):
+    state = db.inspect(target)
+    moved = any(state.attrs[key].history.has_changes() for key in ('city', 'state'))
+    placed = any(state.attrs[key].history.has_changes() for key in ('latitude', 'longitude'))
+    if (moved or target.latitude is None) and not placed:
+        target.latitude, target.longitude = geocoder.locate(target.city, target.state) or (None, None)
+    if target.latitude is None or target.longitude is None:
+        target.grid_y = target.grid_x = None
+    else:
+        target.grid_y, target.grid_x = grid_cell(target.latitude, target.longitude)
+
+
+event.listen(Venue, 'before_insert', locate_venue)
+event.listen(Venue, 'before_update', locate_venue)
+
+
+def geocode_venues(everything=False):
+    # one UPDATE per distinct city, bypassing the ORM hooks: coordinates are
+    # not shown on any page
+    venues = Venue.__table__
+    places = db.session.query(Venue.state, Venue.city).distinct()
+    if not everything:
+        places = places.filter(Venue.latitude.is_(None))
+    located = 0
+    for state, city in places.all():
+        position = geocoder.locate(city, state)
+        if position is None:
+            continue
+        latitude, longitude = position
+        grid_y, grid_x = grid_cell(latitude, longitude)
+        where = and_(venues.c.state == state, venues.c.city == city)
+        if not everything:
+            where = and_(where, venues.c.latitude.is_(None))
+        located += db.session.execute(venues.update().where(where).values(
+            latitude=latitude, longitude=longitude, grid_y=grid_y, grid_x=grid_x)).rowcount
+    db.session.commit()
+    return located
+
+
+def venues_in_box(box, window=None):
+    # window: (start, end) keeps venues with a show starting in it
+    min_y, min_x = grid_cell(box.min_lat, box.min_lng)
+    max_y, max_x = grid_cell(box.max_lat, box.max_lng)
+    query = profiled(Venue, 'map').filter(
+        Venue.grid_y.between(min_y, max_y), Venue.grid_x.between(min_x, max_x),
+        Venue.latitude.between(box.min_lat, box.max_lat), Venue.longitude.between(box.min_lng, box.max_lng))
+    if window is not None:
+        query = query.filter(db.session.query(Shows.show_id).filter(
+            Shows.venue_id == Venue.venue_id, Shows.start_time >= window[0], Shows.start_time < window[1]).exists())
+    return query
+
+
+def venues_near(latitude, longitude, limit, radius_km=None, window=None):
+    # [(distance in km, venue)] nearest first; without radius_km the N
+    # nearest within GEO_MAX_RADIUS_KM
+    radius = radius_km or app.config['GEO_START_RADIUS_KM']
+    while True:
+        found = sorted(((distance_km(latitude, longitude, venue.latitude, venue.longitude), venue)
+                        for venue in venues_in_box(bounding_box(latitude, longitude, radius), window)),
+                       key=lambda hit: (hit[0], hit[1].name, hit[1].venue_id))
+        found = [hit for hit in found if hit[0] <= radius]
+        if radius_km or len(found) >= limit or radius >= app.config['GEO_MAX_RADIUS_KM']:
+            return found[:limit]
+        radius = min(radius * 4, app.config['GEO_MAX_RADIUS_KM'])
+
+
+def finite(value):
+    # float() accepts nan and inf, which no grid cell holds
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
+
+def near_search():
+    # the query arguments shared by /venues/near and /api/venues/near:
+    # an origin (lat and lng, or city and state) with an optional radius_km,
+    # or bbox=min_lat,min_lng,max_lat,max_lng; limit; from and days for the
+    # show window. Returns (origin, [(distance or None, venue)]).
+    args = request.args
+    try:
+        limit = max(1, min(int(args.get('limit', app.config['GEO_NEAR_LIMIT'])), app.config['MAX_PAGE_SIZE']))
+        window = None
+        if args.get('from') or args.get('days'):
+            start = parse_time(args['from']) if args.get('from') else datetime.today()
+            window = (start, start + timedelta(days=min(max(int(args.get('days', 7)), 1), 366)))
+        if args.get('bbox'):
+            box = Box(*[finite(value) for value in args['bbox'].split(',')])
+            venues = venues_in_box(box, window).order_by(Venue.name, Venue.venue_id).limit(limit)
+            return None, [(None, venue) for venue in venues]
+        if args.get('lat') and args.get('lng'):
+            origin = (finite(args['lat']), finite(args['lng']))
+        elif args.get('city'):
+            origin = geocoder.locate(args['city'], args.get('state'))
+        else:
+            return None, []
+        radius = min(finite(args['radius_km']), app.config['GEO_MAX_RADIUS_KM']) if args.get('radius_km') else None
+    except (TypeError, ValueError, OverflowError):
+        abort(400)
+    if origin is None:
+        abort(404)
+    return origin, venues_near(origin[0], origin[1], limit, radius, window)
+
+
+#----------------------------------------------------------------------------#
+# Calendar.
+#----------------------------------------------------------------------------#
+
+# /api/calendar reads the shows starting in a window of days in
+# (start_time, show_id) order off ix_shows_start_time_show_id, a page at a
+# time, and groups them by day. Responses are cached for CALENDAR_CACHE_TTL
+# seconds under the 'calendar' namespace, which show, venue and artist
+# writes bump. Named windows are resolved to dates before the key is built,
+# so ?window=this-weekend shares its entry with the same dates spelled out.
+CALENDAR_WINDOWS = {
+    'today': lambda today: (today, today + timedelta(days=1)),
+    'tomorrow': lambda today: (today + timedelta(days=1), today + timedelta(days=2)),
+    # Friday to Sunday, or what is left of it
+    'this-weekend': lambda today: (today + timedelta(days=max(4 - today.weekday(), 0)),
+                                   today + timedelta(days=7 - today.weekday())),
+    'next-7-days': lambda today: (today, today + timedelta(days=7)),
+}
+
+
+def calendar_query(start, end, state=None, city=None, genres=None):
+    # genres are the artist's
+    query = api_show_query(Shows.start_time >= start, Shows.start_time < end)
+    if state:
+        query = query.filter(Venue.state == state)
+    if city:
+        query = query.filter(Venue.city == city)
+    if genres:
+        query = query.filter(with_genres(Artist, genres))
+    return query
+
+
+def calendar_window():
+    # ?window=<name>, or ?from=<date>&days=7; returns (first day, day after the last)
+    args = request.args
+    today = datetime.today().date()
+    if args.get('window'):
+        if args['window'] not in CALENDAR_WINDOWS:
+            abort(400)
+        return CALENDAR_WINDOWS[args['window']](today)
+    try:
+        start = parse_time(args['from']).date() if args.get('from') else today
+        days = int(args.get('days', 7))
+    except (ValueError, OverflowError):
+        abort(400)
+    return start, start + timedelta(days=min(max(days, 1), app.config['CALENDAR_MAX_DAYS']))
+
+
+def calendar_days(rows):
+    days = []
+    for row in rows:
+        show = row._asdict()
+        day = show['start_time'].date().isoformat()
+        if not days or days[-1]['date'] != day:
+            days.append({'date': day, 'shows': []})
+        days[-1]['shows'].append(show)
+    return days
+
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+# Postgres answers searches from the pg_trgm GIN indexes on artist and venue
+# names; other databases (SQLite in tests) fall back to an in-process trigram
+# index kept in step with committed writes.
+name_indexes = {Venue: TrigramIndex(), Artist: TrigramIndex()}
+
+
+def has_trigram_support():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def like_pattern(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def name_matches(column, term):
+    # pg_trgm's similarity operator is spelled like modulo; using the mod
+    # operator lets the dialect escape it for its paramstyle (%% for psycopg2).
+    return or_(column.ilike(like_pattern(term), escape='\\'), column % term)
+
+
+def index_search(model, term, limit):
+    index = name_indexes[model]
+    if not index.loaded:
+        pk = db.inspect(model).primary_key[0]
+        index.load(db.session.query(pk, model.name).all())
+    return index.search(term, limit)
+
+
+def search_entities(model, term):
+    limit = app.config['SEARCH_LIMIT']
+    if not term.strip():
+        return []
+    pk = db.inspect(model).primary_key[0]
+    if has_trigram_support():
+        return profiled(model, 'list').filter(name_matches(model.name, term)).\
+            order_by(func.similarity(model.name, term).desc(), model.name, pk).limit(limit).all()
+    ranked = index_search(model, term, limit)
+    found = {getattr(entity, pk.key): entity for entity in profiled(model, 'list').filter(pk.in_([key for key, score in ranked]))}
+    return [found[key] for key, score in ranked if key in found]
+
+
+def search_show_rows(term):
+    limit = app.config['SEARCH_LIMIT']
+    if not term.strip():
+        return []
+    artistShows = show_tiles()
+    if has_trigram_support():
+        score = func.greatest(func.similarity(Artist.name, term), func.similarity(Venue.name, term))
+        return artistShows.filter(or_(name_matches(Artist.name, term), name_matches(Venue.name, term))).\
+            order_by(score.desc(), Shows.start_time.desc(), Shows.show_id).limit(limit).all()
+    artist_scores = dict(index_search(Artist, term, limit))
+    venue_scores = dict(index_search(Venue, term, limit))
+    rows = artistShows.filter(or_(Shows.artist_id.in_(list(artist_scores)), Shows.venue_id.in_(list(venue_scores)))).\
+        order_by(Shows.start_time.desc(), Shows.show_id).limit(limit).all()
+    score = lambda row: max(artist_scores.get(row.Artist.artist_id, 0), venue_scores.get(row.Venue.venue_id, 0))
+    return sorted(rows, key=lambda row: -score(row))
+
+
+# /autocomplete answers from an in-process prefix index per model, loaded on
+# first use and kept current by this worker's commits. Writes by other
+# workers arrive when the index is reloaded in the background, which happens
+# at most every AUTOCOMPLETE_RESYNC seconds.
+prefix_indexes = {Venue: PrefixIndex(app.config['AUTOCOMPLETE_MAX_NAMES']),
+                  Artist: PrefixIndex(app.config['AUTOCOMPLETE_MAX_NAMES'])}
+prefix_resync = threading.Lock()
+
+
+def load_prefix_index(model):
+    # the most active names first, so a full index keeps the ones people look for
+    index = prefix_indexes[model]
+    pk = db.inspect(model).primary_key[0]
+    index.begin_load()
+    started = time.time()
+    try:
+        index.load(db.session.query(pk, model.name).order_by(*by_activity(model)).
+                   limit(app.config['AUTOCOMPLETE_MAX_NAMES']).all(), started)
+    except Exception:
+        index.abort_load()
+        raise
+
+
+def resync_prefix_indexes():
+    with app.app_context():
+        try:
+            for model in prefix_indexes:
+                load_prefix_index(model)
+        except Exception:
+            app.logger.exception('autocomplete resync failed')
+        finally:
+            db.session.remove()
+            prefix_resync.release()
+
+
+def prefix_matches(model, term, limit):
+    index = prefix_indexes[model]
+    if not index.loaded:
+        load_prefix_index(model)
+    elif time.time() - index.loaded_at > app.config['AUTOCOMPLETE_RESYNC'] and prefix_resync.acquire(False):
+        threading.Thread(target=resync_prefix_indexes, name='autocomplete-resync', daemon=True).start()
+    return index.complete(term, limit)
+
+
+def keep_name_index(model, pk):
+    @on_commit(model)
+    def update_name_index(operation, values):
+        for index in (name_indexes[model], prefix_indexes[model]):
+            if not index.loaded:
+                continue
+            if operation == 'delete':
+                index.discard(values[pk])
+            else:
+                index.add(values[pk], values['name'])
+
+
+keep_name_index(Venue, 'venue_id')
+keep_name_index(Artist, 'artist_id')
+
+
+#----------------------------------------------------------------------------#
+# Caching.
+#----------------------------------------------------------------------------#
+
+# Rendered GET pages and show tiles are cached read-through in page_cache
+# (see CACHE_* in config.py). Commit hooks delete exactly the keys a write
+# affects; listing pages live under a namespace that is bumped instead,
+# since any insert or rename can shift every page of a listing. Venue and
+# artist pages are cached whole, so only the /shows tiles are cached apart.
+TILE_KINDS = ('listing',)
+
+
+def tile_keys(show_id):
+    # tiles live under the 'tiles' namespace, bumped to drop them all at once
+    namespace = page_cache.namespace('tiles')
+    return ['%s:%s:%s' % (namespace, kind, show_id) for kind in TILE_KINDS]
+
+
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified')
+
+
+def cached_page(key):
+    # cached pages keep their ETag and Last-Modified, so a hit can still
+    # answer a conditional request with 304
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # pages carrying flashed messages are per-user and must not be shared
+            if '_flashes' in session:
+                return view(*args, **kwargs)
+            cache_key = key(**kwargs)
+            cached = page_cache.get(cache_key)
+            if cached is not None:
+                html, headers = json.loads(cached)
+                return app.response_class(html, headers=headers, mimetype='text/html').make_conditional(request)
+            response = app.make_response(view(*args, **kwargs))
+            # a page read from a lagging replica may predate an invalidation
+            replica = g.get('db_replica')
+            if response.status_code == 200 and (replica is None or replica.lag == 0):
+                headers = {name: response.headers[name] for name in VALIDATOR_HEADERS if name in response.headers}
+                ttl = None
+                fresh_until = g.pop('page_fresh_until', None)
+                if fresh_until is not None:
+                    ttl = min(max(int((fresh_until - datetime.today()).total_seconds()) + 1, 1), app.config['CACHE_TTL'])
+                page_cache.set(cache_key, json.dumps([response.get_data(as_text=True), headers]), ttl)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_render(validators, render):
+    # validators is (etag, last_modified); render() only runs when the
+    # client's copy is stale
+    if '_flashes' in session:
+        return render()
+    etag, last_modified = validators
+    last_modified = last_modified.replace(microsecond=0) if last_modified else None
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(render())
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+
+def conditional(validators):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            current = validators(**kwargs)
+            if current is None:
+                return view(*args, **kwargs)
+            return conditional_render(current, lambda: view(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def show_boundary(column, value, now):
+    # the start of the entity's latest show to have begun and of its next
+    # one: the page's split between past and upcoming shows moves at these.
+    # Archived shows all began long ago, so the hot table is enough.
+    last = db.session.query(func.max(Shows.start_time)).filter(column == value, Shows.start_time <= now).scalar()
+    upcoming = db.session.query(func.min(Shows.start_time)).filter(column == value, Shows.start_time > now).scalar()
+    return last, upcoming
+
+
+def entity_validators(model):
+    # primary key and (id, start_time) index lookups instead of the page's
+    # show joins. The ETag names the next show's start, so it changes when
+    # that show moves to the past, and so does Last-Modified.
+    def validators(**kwargs):
+        pk = db.inspect(model).primary_key[0]
+        key = kwargs[pk.key]
+        row = db.session.query(model.version, model.updated_at).filter(pk == key).first()
+        if row is None:
+            return None
+        now = datetime.today()
+        last, upcoming = show_boundary(getattr(Shows, pk.key), key, now)
+        # a cached copy of the page must not outlive the split either
+        g.page_fresh_until = upcoming
+        last_modified = row.updated_at
+        if last is not None:
+            # start_time is local time, updated_at UTC
+            last_modified = max(last_modified, last + (datetime.utcnow() - now))
+        return ('%s-%s-v%d-%s' % (model.__tablename__, key, row.version, upcoming.isoformat() if upcoming else 'none'),
+                last_modified)
+    return validators
+
+
+def listing_validators(entities, *extra):
+    # a listing changes when any of its rows, or which rows it holds, does;
+    # extra covers whatever else the page shows. No Last-Modified: a row
+    # leaving the page does not advance any row's updated_at.
+    versions = [[db.inspect(entity).identity[0], entity.version] for entity in entities]
+    etag = hashlib.sha1(json.dumps([request.full_path, versions, extra]).encode('utf-8')).hexdigest()
+    return etag, None
+
+
+def listing_key(name):
+    return lambda **kwargs: page_cache.namespace(name) + ':' + request.query_string.decode('utf-8')
+
+
+def cache_fragment(kind, show_id, caller):
+    # one namespace lookup per request, not per tile
+    if 'tile_namespace' not in g:
+        g.tile_namespace = page_cache.namespace('tiles')
+    key = '%s:%s:%s' % (g.tile_namespace, kind, show_id)
+    html = page_cache.get(key)
+    if html is None:
+        html = caller()
+        page_cache.set(key, html)
+    return Markup(html)
+
+
+app.jinja_env.globals['cache_fragment'] = cache_fragment
+
+
+def shows_of(connection, column, value):
+    history = show_history_table()
+    return connection.execute(db.select([history.c.show_id, history.c.venue_id, history.c.artist_id]).
+                              where(history.c[column] == value)).fetchall()
+
+
+# Only a change to LABEL_COLUMNS scans a venue's or artist's show history
+# for the counterpart pages and tiles to drop. The keys are collected at
+# flush time, when the previous values are known, and deleted on commit.
+
+def maintain_counterpart_pages(model, key, other_key):
+    prefix = other_key.split('_')[0]
+
+    @on_flush(model)
+    def collect_counterpart_pages(session, operation, values, previous):
+        if operation != 'update' or not LABEL_COLUMNS & set(previous):
+            return
+        keys = session.info.setdefault('stale_pages', [])
+        for show in shows_of(session.connection(), key, values[key]):
+            keys += ['%s:%s' % (prefix, show[other_key])] + tile_keys(show.show_id)
+
+
+maintain_counterpart_pages(Venue, 'venue_id', 'artist_id')
+maintain_counterpart_pages(Artist, 'artist_id', 'venue_id')
+
+
+@event.listens_for(db.session, 'after_commit')
+def delete_stale_pages(session):
+    keys = session.info.pop('stale_pages', None)
+    if keys:
+        page_cache.delete(*keys)
+
+
+@on_commit(Venue)
+def invalidate_venue(operation, values):
+    page_cache.delete('venue:%s' % values['venue_id'])
+    page_cache.bump('venues', 'calendar')
+
+
+@on_commit(Artist)
+def invalidate_artist(operation, values):
+    page_cache.delete('artist:%s' % values['artist_id'])
+    page_cache.bump('artists', 'calendar')
+
+
+@on_commit(Shows)
+def invalidate_show(operation, values):
+    page_cache.delete('venue:%s' % values['venue_id'], 'artist:%s' % values['artist_id'], *tile_keys(values['show_id']))
+    page_cache.bump('venues', 'artists', 'calendar')
+
+
+#----------------------------------------------------------------------------#
+# Live feed.
+#----------------------------------------------------------------------------#
+
+# Committed show changes are pushed to /shows/feed clients as JSON events
+# shaped like the /api/shows rows. Bulk imports and archiving bypass the ORM
+# and are not published.
+
+FEED_EVENTS = {'insert': 'created', 'update': 'updated', 'delete': 'deleted'}
+
+
+@on_commit(Shows)
+def publish_show(operation, values):
+    if not show_feed.active():
+        return
+    show = {key: values[key] for key in ('show_id', 'start_time', 'duration', 'venue_id', 'artist_id')}
+    for model, prefix in ((Venue, 'venue'), (Artist, 'artist')):
+        key = prefix + '_id'
+        row = db.engine.execute(db.select([model.name, model.image_link]).where(getattr(model, key) == show[key])).first()
+        show[prefix + '_name'], show[prefix + '_image_link'] = row or (None, None)
+    event = {'event': FEED_EVENTS[operation], 'show': show}
+    if operation == 'insert':
+        event['cursor'] = encode_cursor([show['show_id']])
+    show_feed.publish(api_json(event))
+
+
+#----------------------------------------------------------------------------#
+# Deletes.
+#----------------------------------------------------------------------------#
+
+# A venue's or artist's shows, archived shows and matches go with it through
+# ON DELETE CASCADE without being loaded, so the Shows hooks never see them.
+# release_shows runs just before the DELETE and does their work in a few
+# statements: it takes the shows off the counterparts' counters, bumping
+# their versions, and once the transaction commits forget_released_shows
+# drops the counterparts' cached pages and the tiles namespace, and
+# announces the deleted shows on the live feed if anyone is listening.
+RELEASED = {Venue: ('venue_id', Artist, 'artist_id'), Artist: ('artist_id', Venue, 'venue_id')}
+
+
+def release_shows(session, connection, model, ids):
+    key, other, other_key = RELEASED[model]
+    watermark = counters_watermark(connection)
+    history = show_history_table()
+    table = other.__table__
+    released = history.c[key].in_(ids)
+    counterparts = db.select([history.c[other_key]]).where(released).distinct()
+
+    def count(*criteria):
+        return db.select([func.count()]).select_from(history).\
+            where(and_(released, history.c[other_key] == table.c[other_key], *criteria)).as_scalar()
+    connection.execute(table.update().where(table.c[other_key].in_(counterparts)).values(
+        upcoming_show_count=table.c.upcoming_show_count - count(history.c.start_time > watermark),
+        past_show_count=table.c.past_show_count - count(history.c.start_time <= watermark),
+        show_count=table.c.show_count - count(), **new_version(table)))
+    shows = []
+    if show_feed.active():
+        shows = [dict(row) for row in connection.execute(api_show_query(getattr(Shows, key).in_(ids)).statement)]
+    others = [row[0] for row in connection.execute(counterparts)]
+    session.info.setdefault('released', []).append((other_key, others, shows))
+
+
+def release_deleted_shows(mapper, connection, target):
+    model = mapper.class_
+    release_shows(db.object_session(target), connection, model, [getattr(target, RELEASED[model][0])])
+
+
+event.listen(Venue, 'before_delete', release_deleted_shows)
+event.listen(Artist, 'before_delete', release_deleted_shows)
+
+
+@event.listens_for(db.session, 'after_commit')
+def forget_released_shows(session):
+    for other_key, others, shows in session.info.pop('released', []):
+        prefix = other_key.split('_')[0]
+        page_cache.delete(*['%s:%s' % (prefix, other_id) for other_id in others])
+        page_cache.bump('venues', 'artists', 'calendar', 'tiles')
+        if show_feed.active():
+            for show in shows:
+                show_feed.publish(api_json({'event': FEED_EVENTS['delete'], 'show': show}))
+
+
+def delete_entities(model, ids):
+    # one DELETE for many venues or artists, loading neither them nor their
+    # shows; returns how many were deleted
+    table = model.__table__
+    pk = table.c[RELEASED[model][0]]
+    session = db.session
+    connection = session.connection()
+    rows = [dict(row) for row in connection.execute(table.select().where(pk.in_(ids)))]
+    if rows:
+        ids = [row[pk.key] for row in rows]
+        release_shows(session, connection, model, ids)
+        connection.execute(table.delete().where(pk.in_(ids)))
+        record_bulk_changes(session, model, 'delete', rows)
+    session.commit()
+    return len(rows)
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+def explain(query):
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    if db.engine.dialect.name == 'postgresql':
+        rows = db.session.connection().execute('EXPLAIN ' + str(compiled), compiled.params)
+    else:
+        params = compiled.params
+        rows = db.session.connection().execute('EXPLAIN QUERY PLAN ' + str(compiled), [params[name] for name in compiled.positiontup])
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+
+@app.cli.command('check-show-indexes')
+@click.option('--venue-id', type=int, help='Venue to plan for (defaults to any venue with shows).')
+@click.option('--artist-id', type=int, help='Artist to plan for (defaults to any artist with shows).')
+@click.option('--no-seqscan', is_flag=True, help='Discourage sequential scans, to check the indexes are usable at all.')
+@click.option('--verbose', is_flag=True, help='Print the full plans.')
+def check_show_indexes(venue_id, artist_id, no_seqscan, verbose):
+    """Report whether the planner uses the shows indexes for the model queries."""
+    sample = db.session.query(Shows.venue_id, Shows.artist_id).first()
+    venue_id = venue_id or (sample and sample.venue_id) or 0
+    artist_id = artist_id or (sample and sample.artist_id) or 0
+    if no_seqscan and db.engine.dialect.name == 'postgresql':
+        db.session.execute('SET LOCAL enable_seqscan = off')
+    # partitions name their copies of the indexes <partition>_venue_id_start_time_idx
+    queries = [
+        ('Venue.past_shows', Venue.past_shows(venue_id), 'venue_id_start_time'),
+        ('Venue.upcoming_shows', Venue.upcoming_shows(venue_id), 'venue_id_start_time'),
+        ('Artist.past_shows', Artist.past_shows(artist_id), 'artist_id_start_time'),
+        ('Artist.upcoming_shows', Artist.upcoming_shows(artist_id), 'artist_id_start_time'),
+        ('calendar', calendar_query(datetime.today(), datetime.today() + timedelta(days=7)), 'start_time_show_id'),
+    ]
+    for name, query, index in queries:
+        plan = explain(query)
+        click.echo('%-24s %s the (%s) index' % (name, 'uses' if index in plan else 'DOES NOT use', index.replace('_id_', '_id, ').replace('_time_', '_time, ')))
+        if verbose:
+            click.echo(plan)
+    db.session.rollback()
+
+
+# columns a table's primary key has in the database on top of the model's
+PARTITION_KEYS = {'shows': {'start_time'}}
+
+
+def schema_drift():
+    # [(table, difference)] between the models and the connected database
+    inspector = db.inspect(db.engine)
+    existing = set(inspector.get_table_names())
+    drift = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            drift.append((table.name, 'missing'))
+            continue
+        columns = {column['name']: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                drift.append((table.name, 'no column %s' % column.name))
+            elif not column.primary_key and columns[column.name]['nullable'] != column.nullable:
+                drift.append((table.name, '%s is %sNULL in the database' % (
+                    column.name, '' if columns[column.name]['nullable'] else 'NOT ')))
+        primary_key = set(inspector.get_pk_constraint(table.name)['constrained_columns'])
+        expected = set(table.primary_key.columns.keys())
+        if primary_key not in (expected, expected | PARTITION_KEYS.get(table.name, set())):
+            drift.append((table.name, 'primary key is (%s)' % ', '.join(sorted(primary_key))))
+    return drift
+
+
+@app.cli.command('check-schema')
+def check_schema():
+    """Compare the models' columns, nullability and primary keys with the database."""
+    drift = schema_drift()
+    for table, difference in drift:
+        click.echo('%-16s %s' % (table, difference))
+    if drift:
+        raise click.ClickException('the models and the database differ; add a migration or fix the model')
+    click.echo('the models match the database')
+
+
+@app.cli.command('roll-show-counters')
+def roll_show_counters_command():
+    """Move shows that have started since the last run from upcoming to past in the show counters."""
+    moved = roll_show_counters()
+    if moved:
+        page_cache.bump('venues', 'artists')
+    click.echo('%d shows moved from upcoming to past' % moved)
+
+
+@app.cli.command('refresh-show-counters')
+def refresh_show_counters_command():
+    """Recount every venue's and artist's shows from scratch."""
+    refresh_show_counters()
+    page_cache.bump('venues', 'artists')
+    click.echo('show counters rebuilt')
+
+
+@app.cli.command('archive-shows')
+@click.option('--before', type=click.DateTime(), help='Archive shows starting before this time '
+                                                     '(defaults to SHOW_ARCHIVE_AFTER_DAYS ago).')
+@click.option('--batch-size', default=5000, show_default=True)
+def archive_shows_command(before, batch_size):
+    """Move old shows to shows_archive and drop their emptied partitions."""
+    before = before or datetime.today() - timedelta(days=app.config['SHOW_ARCHIVE_AFTER_DAYS'])
+    click.echo('archived %d shows starting before %s' % (archive_shows(before, batch_size), before))
+    page_cache.bump('calendar')
+    if show_partitions_enabled():
+        for name in drop_archived_partitions(before):
+            click.echo('dropped partition %s' % name)
+
+
+@app.cli.command('create-show-partitions')
+@click.option('--months-ahead', type=int, help='Defaults to SHOW_PARTITION_MONTHS_AHEAD.')
+def create_show_partitions_command(months_ahead):
+    """Create the monthly shows partitions from this month on."""
+    if not show_partitions_enabled():
+        raise click.ClickException('the shows table is not partitioned; run flask db upgrade on Postgres')
+    months_ahead = app.config['SHOW_PARTITION_MONTHS_AHEAD'] if months_ahead is None else months_ahead
+    for name in ensure_show_partitions(months_ahead):
+        click.echo('created partition %s' % name)
+
+
+IMPORT_KINDS = {
+    'venues': ImportKind(Venue, VenueForm, ['name', 'city', 'state', 'address', 'phone', 'genres', 'website', 'image_link',
+                                            'facebook_link', 'seeking_talent', 'seeking_description']),
+    'artists': ImportKind(Artist, ArtistForm, ['name', 'city', 'state', 'phone', 'genres', 'image_link', 'facebook_link',
+                                               'seeking_venue', 'seeking_description']),
+    'shows': ImportKind(Shows, ShowForm, ['start_time', 'duration'], references=[
+        Reference('artist_id', 'artist_name', Artist, Artist.artist_id, Artist.name),
+        Reference('venue_id', 'venue_name', Venue, Venue.venue_id, Venue.name),
+    ]),
+}
+
+
+def importing(kind):
+    # bulk inserts bypass the ORM, so flush hooks do not see them either
+    def before_commit(rows):
+        if kind in ('venues', 'artists'):
+            model = IMPORT_KINDS[kind].model
+            added = {}
+            for row in rows:
+                for key in facet_keys(model, row):
+                    added[key] = added.get(key, 0) + 1
+            for key, count in added.items():
+                adjust_facets(db.session.connection(), [key], count)
+        if kind == 'shows':
+            watermark = counters_watermark(db.session.connection())
+            added = {}
+            for row in rows:
+                for model, key in COUNTED:
+                    counter = (key, row[key], is_upcoming(row['start_time'], watermark))
+                    added[counter] = added.get(counter, 0) + 1
+            for (key, owner, upcoming), count in added.items():
+                adjust_show_counts(db.session.connection(), {key: owner}, upcoming, count)
+        if kind == 'venues':
+            added = {}
+            for row in rows:
+                key = area_key(row)
+                added[key] = added.get(key, 0) + 1
+            for (state, city), count in added.items():
+                adjust_area(db.session.connection(), state, city, delta=count)
+    return before_commit
+
+
+def imported(kind):
+    # bulk inserts bypass the ORM, so commit hooks do not see them
+    def after_batch(rows):
+        if kind == 'shows':
+            page_cache.delete(*set(['venue:%s' % row['venue_id'] for row in rows] + ['artist:%s' % row['artist_id'] for row in rows]))
+            page_cache.bump('venues', 'artists', 'calendar')
+        else:
+            page_cache.bump(kind, 'calendar')
+            name_indexes[IMPORT_KINDS[kind].model].loaded = False
+            genre_indexes[IMPORT_KINDS[kind].model].loaded = False
+            prefix_indexes[IMPORT_KINDS[kind].model].loaded = False
+    return after_batch
+
+
+@app.cli.command('refresh-venue-areas')
+def refresh_venue_areas_command():
+    """Rebuild the venue_areas summary from the venues table."""
+    refresh_venue_areas()
+    click.echo('%d areas' % VenueArea.query.count())
+
+
+@app.cli.command('refresh-genre-facets')
+def refresh_genre_facets_command():
+    """Rebuild the genre_facets sidebar counts from the venues and artists tables."""
+    refresh_genre_facets()
+    click.echo('%d facet rows' % GenreFacet.query.count())
+
+
+@app.cli.command('refresh-matches')
+def refresh_matches_command():
+    """Rebuild the venue-artist matches from scratch."""
+    click.echo('%d matches' % refresh_matches())
+
+
+@app.cli.command('geocode-venues')
+@click.option('--all', 'everything', is_flag=True, help='Also relocate venues that already have coordinates.')
+def geocode_venues_command(everything):
+    """Place venues without coordinates at their city's centroid."""
+    click.echo('%d venues located' % geocode_venues(everything))
+
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=5000, show_default=True)
+@click.option('--resume', is_flag=True, help='Continue after the last committed batch recorded in PATH.checkpoint.')
+def import_data(kind, path, fmt, batch_size, resume):
+    """Bulk load venues, artists or shows from a CSV or NDJSON file.
+
+    Records are validated with VenueForm, ArtistForm or ShowForm. Shows may
+    name their artist and venue by id (artist_id, venue_id) or by name
+    (artist_name, venue_name) and give a duration in minutes. They are
+    checked like bookings made on the site, so double bookings are
+    rejected, also against earlier records in the file. Rejected records
+    are written to PATH.rejects.
+    Venue imports then locate the new venues, and venue and artist imports
+    rebuild the matches once at the end.
+    """
+    fmt = fmt or ('ndjson' if path.endswith(('.ndjson', '.jsonl', '.json')) else 'csv')
+    loader = BulkLoader(db, IMPORT_KINDS[kind], batch_size, progress=click.echo,
+                        check_rows=check_imported_shows if kind == 'shows' else None,
+                        before_commit=importing(kind), after_batch=imported(kind))
+    state = loader.run(path, fmt, resume=resume)
+    if kind == 'venues':
+        click.echo('%d venues located' % geocode_venues())
+    if kind in ('venues', 'artists'):
+        click.echo('%d matches' % refresh_matches())
+    if state['rejected']:
+        click.echo('see %s.rejects for the rejected records' % path)
+
+
+@app.cli.command('delete-data')
+@click.argument('kind', type=click.Choice(['artists', 'venues']))
+@click.argument('ids', type=int, nargs=-1, required=True)
+@click.option('--batch-size', default=500, show_default=True)
+def delete_data(kind, ids, batch_size):
+    """Delete venues or artists by id, with their shows, archived shows and matches.
+
+    Each batch is one transaction. Neither the entities nor their shows are
+    loaded; the shows are removed by ON DELETE CASCADE.
+    """
+    model = IMPORT_KINDS[kind].model
+    deleted = 0
+    for start in range(0, len(ids), batch_size):
+        deleted += delete_entities(model, list(ids[start:start + batch_size]))
+    click.echo('%d %s deleted' % (deleted, kind))
 
 
 #----------------------------------------------------------------------------#
@@ -117,6 +1956,89 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Pagination.
+#----------------------------------------------------------------------------#
+
+Page = namedtuple('Page', ['items', 'next_cursor', 'prev_cursor'])
+
+
+def encode_cursor(values):
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def parse_time(value):
+    # times in query arguments and cursors may carry an offset; start_time
+    # holds naive server-local times, like datetime.today()
+    parsed = dateutil.parser.parse(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return tuple(parse_time(value) if value is not None and isinstance(column.type, db.DateTime) else value
+                     for column, value in zip(columns, values))
+    except (ValueError, TypeError, UnicodeError, OverflowError):
+        abort(400)
+
+
+def page_url(**changes):
+    # the current URL with its query arguments updated; None drops one
+    args = request.args.to_dict(flat=False)
+    args.pop('after', None)
+    args.pop('before', None)
+    for key, value in changes.items():
+        if value is None:
+            args.pop(key, None)
+        else:
+            args[key] = value
+    return url_for(request.endpoint, **dict(request.view_args or {}, **args))
+
+
+app.jinja_env.globals['page_url'] = page_url
+
+
+def page_size():
+    size = request.args.get('per_page', app.config['PAGE_SIZE'], type=int)
+    return max(1, min(size, app.config['MAX_PAGE_SIZE']))
+
+
+def keyset_page(query, columns, key):
+    # columns must be a unique, stable sort key; key(row) returns the row's values for them
+    size = page_size()
+    after = request.args.get('after')
+    before = request.args.get('before')
+    if before:
+        values = decode_cursor(before, columns)
+        rows = query.filter(tuple_(*columns) < values).order_by(*[column.desc() for column in columns]).limit(size + 1).all()
+        has_more = len(rows) > size
+        rows = rows[:size][::-1]
+        prev_cursor = encode_cursor(key(rows[0])) if has_more else None
+        next_cursor = encode_cursor(key(rows[-1])) if rows else None
+    else:
+        if after:
+            query = query.filter(tuple_(*columns) > decode_cursor(after, columns))
+        rows = query.order_by(*columns).limit(size + 1).all()
+        has_more = len(rows) > size
+        rows = rows[:size]
+        next_cursor = encode_cursor(key(rows[-1])) if has_more else None
+        prev_cursor = encode_cursor(key(rows[0])) if after and rows else None
+    return Page(rows, next_cursor, prev_cursor)
+
+
+def shows_page():
+    return keyset_page(show_tiles(), [Shows.start_time, Shows.show_id], lambda row: (row.Shows.start_time, row.Shows.show_id))
+
+
+def latest_show_id():
+    return db.session.query(func.max(Shows.show_id)).scalar() or 0
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -127,27 +2049,61 @@ def index():
     return render_template('pages/home.html')
 
 
+@app.route('/autocomplete')
+def autocomplete():
+    # ?q=<prefix>&type=venue|artist&limit=10; names starting with q come
+    # before names with a later word starting with it
+    term = request.args.get('q', '')
+    kind = request.args.get('type')
+    limit = max(1, min(request.args.get('limit', app.config['AUTOCOMPLETE_LIMIT'], type=int), app.config['SEARCH_LIMIT']))
+    results = []
+    for model, model_kind, endpoint, pk in ((Venue, 'venue', 'show_venue', 'venue_id'), (Artist, 'artist', 'show_artist', 'artist_id')):
+        if kind in (None, model_kind):
+            results += [(level, name.lower(), {'type': model_kind, 'id': key, 'name': name, 'url': url_for(endpoint, **{pk: key})})
+                        for level, key, name in prefix_matches(model, term, limit)]
+    results.sort(key=lambda result: result[:2])
+    return jsonify({'q': term, 'results': [result for level, sort_name, result in results[:limit]]})
+
+
 #  Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@cached_page(listing_key('venues'))
 def venues():
-    areas = Venue.query.order_by(Venue.city).all()
-    return render_template('pages/venues.html', areas=areas)
+    page, areas = venue_areas_page(activity=request.args.get('sort') == 'activity')
+    return conditional_render(listing_validators([venue for area in areas for venue in area['venues']]),
+                              lambda: render_template('pages/venues.html', areas=areas, page=page))
+
+
+
+@app.route('/venues/browse')
+def browse_venues():
+    return browse(Venue, 'Venues')
 
 
+@app.route('/venues/near')
+def venues_near_page():
+    origin, found = near_search()
+    return render_template('pages/venues_near.html', origin=origin, found=found, args=request.args,
+                           states=[value for value, label in VenueForm.state.kwargs['choices']])
+
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
     term=request.form.get('search_term', '')
-    results = Venue.query.filter(Venue.name.ilike('%'+term+'%'))
+    results = search_entities(Venue, term)
     return render_template('pages/search_venues.html', results=results, search_term=term)
 
 
 @app.route('/venues/<int:venue_id>')
+@cached_page(lambda venue_id: 'venue:%d' % venue_id)
+@conditional(entity_validators(Venue))
 def show_venue(venue_id):
-    data = Venue.query.filter(Venue.venue_id==venue_id).first()
-    return render_template('pages/show_venue.html', venue=data)
+    data = Venue.detail(venue_id)
+    if data is None:
+        abort(404)
+    return render_template('pages/show_venue.html', **data)
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -176,9 +2132,6 @@ def create_venue_submission():
         error = True
         db.session.rollback()
         print(sys.exc_info())
-
-    finally:
-        db.session.close()
     if error:
         flash('An error occurred. Venue ' + form.name.data+ ' could not be listed.')
     else:
@@ -186,18 +2139,17 @@ def create_venue_submission():
 
     return redirect(url_for('show_venue', venue_id=venueId))
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
+    error = False
     try:
-        venue = Venue.query.filter_by(venue_id=venue_id).first()
-        db.session.delete(venue)
-        db.session.commit()
+        deleted = delete_entities(Venue, [venue_id])
     except:
         error = True
         db.session.rollback()
         print(sys.exc_info())
-    finally:
-        db.session.close()
+    if not error and not deleted:
+        abort(404)
     if error:
         flash('An error occurred. Venue could not be deleted.')
     else:
@@ -212,32 +2164,48 @@ def delete_venue(venue_id):
 
 
 @app.route('/artists')
+@cached_page(listing_key('artists'))
 def artists():
-    artists = Artist.query.all()
-    return render_template('pages/artists.html', artists=artists)
+    if request.args.get('sort') == 'activity':
+        page = keyset_page(profiled(Artist, 'list'), by_activity(Artist),
+                           lambda artist: (-artist.upcoming_show_count, -artist.show_count, artist.name, artist.artist_id))
+    else:
+        page = keyset_page(profiled(Artist, 'list'), [Artist.name, Artist.artist_id], lambda artist: (artist.name, artist.artist_id))
+    return conditional_render(listing_validators(page.items),
+                              lambda: render_template('pages/artists.html', artists=page.items, page=page))
+
+
+@app.route('/artists/browse')
+def browse_artists():
+    return browse(Artist, 'Artists')
 
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
     term=request.form.get('search_term', '')
-    results = Artist.query.filter(Artist.name.ilike('%'+term+'%'))
+    results = search_entities(Artist, term)
     return render_template('pages/search_artists.html', results=results, search_term=term)
 
 
 @app.route('/artists/<int:artist_id>')
+@cached_page(lambda artist_id: 'artist:%d' % artist_id)
+@conditional(entity_validators(Artist))
 def show_artist(artist_id):
     form=ArtistForm()
-    artist= Artist.query.filter(Artist.artist_id==artist_id).first()
-    return render_template('pages/show_artist.html', form=form, artist=artist)
+    data = Artist.detail(artist_id)
+    if data is None:
+        abort(404)
+    return render_template('pages/show_artist.html', form=form, **data)
 
 #  Update
 #  ----------------------------------------------------------------
 
 
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@use_primary
 def edit_artist(artist_id):
     form = ArtistForm()
-    artist = Artist.query.filter_by(artist_id=artist_id).first()
+    artist = profiled(Artist, 'edit').filter_by(artist_id=artist_id).first()
     form.name.data=artist.name
     form.genres.data=artist.genres
     form.city.data=artist.city
@@ -256,13 +2224,10 @@ def edit_artist_submission(artist_id):
     form = ArtistForm(request.form)
     body={};
     genres=request.form.getlist('genres')
-    if form.seeking_venue.data=='True':
-        isSeeking=True
-    else:
-        isSeeking=False
+    isSeeking=form.seeking_venue.data
 
     try:
-        artist= Artist.query.filter_by(artist_id=artist_id).first()
+        artist= profiled(Artist, 'edit').filter_by(artist_id=artist_id).first()
         artist.name=form.name.data
         artist.city=form.city.data
         artist.state=form.state.data
@@ -277,8 +2242,6 @@ def edit_artist_submission(artist_id):
         error = True
         db.session.rollback()
         print(sys.exc_info())
-    finally:
-        db.session.close()
     if error:
         flash('An error occurred. Artist ' + form.name.data+ ' could not be listed.')
         return redirect(url_for('index'))
@@ -289,9 +2252,10 @@ def edit_artist_submission(artist_id):
 
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@use_primary
 def edit_venue(venue_id):
     form = VenueForm()
-    venue = Venue.query.filter_by(venue_id=venue_id).first()
+    venue = profiled(Venue, 'edit').filter_by(venue_id=venue_id).first()
     form.name.data=venue.name
     form.address.data=venue.address
     form.genres.data=venue.genres
@@ -312,13 +2276,10 @@ def edit_venue_submission(venue_id):
     form = VenueForm(request.form)
     body={};
     genres=request.form.getlist('genres')
-    if form.seeking_venue.data=='True':
-        isSeeking=True
-    else:
-        isSeeking=False
+    isSeeking=form.seeking_talent.data
 
     try:
-        venue = Venue.query.filter_by(venue_id=venue_id).first()
+        venue = profiled(Venue, 'edit').filter_by(venue_id=venue_id).first()
         venue.name=form.name.data
         venue.city=form.city.data
         venue.state=form.state.data
@@ -334,8 +2295,6 @@ def edit_venue_submission(venue_id):
         error = True
         db.session.rollback()
         print(sys.exc_info())
-    finally:
-        db.session.close()
     if error:
         flash('An error occurred. Venue ' + form.name.data+ ' could not be updated.')
         return redirect(url_for('index'))
@@ -370,8 +2329,6 @@ def create_artist_submission():
         error = True
         db.session.rollback()
         print(sys.exc_info())
-    finally:
-        db.session.close()
     if error:
         flash('An error occurred. Artist ' + form.name.data+ ' could not be listed.')
         return redirect(url_for('index'))
@@ -379,18 +2336,17 @@ def create_artist_submission():
         flash('Artist ' + form['name'].data +' was successfully listed!')
         return redirect(url_for('show_artist', artist_id=artistId))
 
-@app.route('/artists/<artist_id>/delete', methods=['DELETE'])
+@app.route('/artists/<int:artist_id>/delete', methods=['DELETE'])
 def delete_artist(artist_id):
+    error = False
     try:
-        artist = Artist.query.filter_by(artist_id=artist_id).first()
-        db.session.delete(artist)
-        db.session.commit()
+        deleted = delete_entities(Artist, [artist_id])
     except:
         error = True
         db.session.rollback()
         print(sys.exc_info())
-    finally:
-        db.session.close()
+    if not error and not deleted:
+        abort(404)
     if error:
         flash('An error occurred. Artist could not be deleted.')
     else:
@@ -399,18 +2355,58 @@ def delete_artist(artist_id):
     return redirect(url_for('index'))
 
 
+#  Cache and metrics
+#  ----------------------------------------------------------------
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(page_cache.stats())
+
+
+@app.route('/metrics')
+def metrics():
+    lines = sql_instrumentation.metrics() + replica_router.metrics() + pool_monitor.metrics() + show_feed.metrics()
+    stats = page_cache.stats()
+    for name, key in (('fyyur_cache_hits_total', 'hits'), ('fyyur_cache_misses_total', 'misses')):
+        lines.append('# TYPE %s counter' % name)
+        for kind, counts in sorted(stats['kinds'].items()):
+            lines.append('%s{kind="%s"} %d' % (name, kind, counts[key]))
+    lines.append('# TYPE fyyur_cache_entries gauge')
+    lines.append('fyyur_cache_entries %d' % stats['entries'])
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
 #  Shows
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
 def shows():
-    artistShows= db.session.query(Artist, Venue, Shows).join(Shows, Shows.artist_id ==Artist.artist_id).join(Venue,Venue.venue_id==Shows.venue_id)
-    return render_template('pages/shows.html', shows=artistShows)
+    page = shows_page()
+    return render_template('pages/shows.html', shows=page.items, page=page, cursor=encode_cursor([latest_show_id()]))
+
+@app.route('/shows/feed')
+def show_feed_stream():
+    # Server-Sent Events; the stream outlives the request context, so it
+    # holds no database connection while it waits
+    subscription = show_feed.subscribe()
+    if subscription is None:
+        abort(503)
+    keepalive = app.config['SHOW_FEED_KEEPALIVE']
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            while not subscription.dropped:
+                payload = subscription.next(keepalive)
+                yield ': keepalive\n\n' if payload is None else 'data: %s\n\n' % payload
+        finally:
+            show_feed.unsubscribe(subscription)
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/shows/search', methods=['POST'])
 def search_shows():
     term=request.form.get('search_term', '')
-    results = db.session.query(Artist, Venue, Shows).join(Shows, Shows.artist_id ==Artist.artist_id).join(Venue,Venue.venue_id==Shows.venue_id).filter(Artist.name.ilike('%'+term+'%'))
+    results = search_show_rows(term)
     return render_template('pages/search_shows.html', results=results, search_term=term)
 
 
@@ -425,29 +2421,224 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
     error = False
+    conflict = None
+    invalid = None
     form = ShowForm(request.form)
     body={};
+    # an empty duration means the default; one that is not a number stays None and is refused
+    duration = form.duration.data if (form.duration.raw_data or [''])[0].strip() else app.config['SHOW_DURATION']
     try:
-        show = Shows(artist_id=form.artist_id.data, venue_id=form.venue_id.data, start_time=form.start_time.data)
-        db.session.add(show)
-        db.session.commit()
+        show = book_show(form.artist_id.data, form.venue_id.data, form.start_time.data, duration)
 
         body['artist_id']=show.artist_id
         body['venue_id']=show.venue_id
         body['start_time']=show.start_time
 
+    except BookingConflict as booking:
+        conflict = booking.args[0] or (None, None, None)
+    except InvalidBooking as reason:
+        invalid = str(reason)
     except:
         error = True
         db.session.rollback()
         print(sys.exc_info())
-    finally:
-        db.session.close()
-    if error:
+    if conflict:
+        show_id, start, end = conflict
+        if start:
+            flash('Venue is already booked from %s to %s. Show could not be listed.' % (start, end))
+        else:
+            flash('Venue is already booked at that time. Show could not be listed.')
+    elif invalid:
+        flash(invalid + ' Show could not be listed.')
+    elif error:
         flash('An error occurred. Show  could not be listed.')
     else:
         flash('Show was successfully listed!')
-    artistShows= db.session.query(Artist, Venue, Shows).join(Shows, Shows.artist_id ==Artist.artist_id).join(Venue,Venue.venue_id==Shows.venue_id)
-    return render_template('pages/shows.html', shows=artistShows)
+        return redirect(url_for('shows'))
+    return redirect(url_for('create_shows'))
+
+
+#  API
+#  ----------------------------------------------------------------
+#  Read-only JSON exports. Rows are streamed from a server-side cursor, as a
+#  chunked JSON document or, with ?format=ndjson, one JSON object per line.
+#  ?since=<datetime> limits shows to those starting at or after it.
+
+API_SHOW_COLUMNS = [Shows.show_id, Shows.start_time, Shows.duration, Shows.venue_id, Venue.name.label('venue_name'),
+                    Venue.image_link.label('venue_image_link'), Shows.artist_id, Artist.name.label('artist_name'),
+                    Artist.image_link.label('artist_image_link')]
+
+
+def api_json(value):
+    return json.dumps(value, default=lambda obj: obj.isoformat() if isinstance(obj, datetime) else str(obj))
+
+
+def api_since():
+    since = request.args.get('since')
+    if not since:
+        return None
+    try:
+        return parse_time(since)
+    except (ValueError, OverflowError):
+        abort(400)
+
+
+def api_show_query(*criteria):
+    return db.session.query(*API_SHOW_COLUMNS).join(Artist, Artist.artist_id == Shows.artist_id).\
+        join(Venue, Venue.venue_id == Shows.venue_id).filter(*criteria)
+
+
+def api_show_rows(*criteria):
+    query = api_show_query(*criteria)
+    since = api_since()
+    if since is not None:
+        query = query.filter(Shows.start_time >= since)
+    rows = query.order_by(Shows.start_time, Shows.show_id).yield_per(app.config['API_STREAM_BATCH'])
+    return (row._asdict() for row in rows)
+
+
+def api_stream(shows, entity=None):
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            if entity is not None:
+                yield api_json(entity) + '\n'
+            for show in shows:
+                yield api_json(show) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    def generate():
+        # the entity's fields, then its shows as they are read
+        yield api_json(entity or {})[:-1] + (', ' if entity else '') + '"shows": ['
+        for number, show in enumerate(shows):
+            yield (',\n' if number else '\n') + api_json(show)
+        yield '\n]}\n'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def api_entity(model, key):
+    entity = profiled(model, 'edit').get(key)
+    if entity is None:
+        abort(404)
+    return {column.key: getattr(entity, column.key) for column in db.inspect(model).column_attrs}
+
+
+@app.route('/api/shows')
+def api_shows():
+    return api_stream(api_show_rows())
+
+
+@app.route('/api/shows/new')
+def api_new_shows():
+    # Shows listed after ?cursor, oldest first, at most a page of them, with
+    # the cursor to ask with next time. Without a cursor only the current
+    # one is returned. Show ids are taken before commit, so a show whose
+    # transaction commits after a later-numbered one can be missed here; the
+    # next full listing has it.
+    cursor = request.args.get('cursor')
+    if cursor is None:
+        return Response(api_json({'shows': [], 'cursor': encode_cursor([latest_show_id()]), 'more': False}),
+                        mimetype='application/json')
+    last_id, = decode_cursor(cursor, [Shows.show_id])
+    if not isinstance(last_id, int):
+        abort(400)
+    size = page_size()
+    rows = [row._asdict() for row in api_show_query(Shows.show_id > last_id).order_by(Shows.show_id).limit(size + 1)]
+    shows = rows[:size]
+    if shows:
+        last_id = shows[-1]['show_id']
+    return Response(api_json({'shows': shows, 'cursor': encode_cursor([last_id]), 'more': len(rows) > size}),
+                    mimetype='application/json')
+
+
+@app.route('/api/calendar')
+def api_calendar():
+    # ?window=today|tomorrow|this-weekend|next-7-days or ?from=<date>&days=7,
+    # then state, city and genre (repeatable) filters; paged with per_page and
+    # the after/before cursors
+    first, last = calendar_window()
+    state = request.args.get('state') or None
+    city = request.args.get('city') or None
+    genres = sorted(set(request.args.getlist('genre')))
+    key = page_cache.namespace('calendar') + ':' + json.dumps(
+        [first.isoformat(), last.isoformat(), state, city, genres, page_size(),
+         request.args.get('after'), request.args.get('before')])
+    body = page_cache.get(key)
+    if body is None:
+        start, end = [datetime.combine(day, datetime.min.time()) for day in (first, last)]
+        page = keyset_page(calendar_query(start, end, state, city, genres), [Shows.start_time, Shows.show_id],
+                           lambda row: (row.start_time, row.show_id))
+        body = api_json({'from': first.isoformat(), 'to': (last - timedelta(days=1)).isoformat(),
+                         'days': calendar_days(page.items), 'next': page.next_cursor, 'prev': page.prev_cursor})
+        # a page read from a lagging replica may predate an invalidation
+        replica = g.get('db_replica')
+        if replica is None or replica.lag == 0:
+            page_cache.set(key, body, app.config['CALENDAR_CACHE_TTL'])
+    return Response(body, mimetype='application/json')
+
+
+@app.route('/api/venues/near')
+def api_venues_near():
+    origin, found = near_search()
+    return Response(api_json({'origin': origin and {'lat': origin[0], 'lng': origin[1]}, 'venues': [
+        {'venue_id': venue.venue_id, 'name': venue.name, 'city': venue.city, 'state': venue.state,
+         'image_link': venue.image_link, 'lat': venue.latitude, 'lng': venue.longitude,
+         'distance_km': None if distance is None else round(distance, 2),
+         'url': url_for('show_venue', venue_id=venue.venue_id)}
+        for distance, venue in found]}), mimetype='application/json')
+
+
+@app.route('/api/venues/<int:venue_id>')
+def api_venue(venue_id):
+    return api_stream(api_show_rows(Shows.venue_id == venue_id), api_entity(Venue, venue_id))
+
+
+@app.route('/api/artists/<int:artist_id>')
+def api_artist(artist_id):
+    return api_stream(api_show_rows(Shows.artist_id == artist_id), api_entity(Artist, artist_id))
+
+
+def api_matches(model, entity_id):
+    # ?same_city=1&limit=20
+    key, seeking, other, other_key, other_seeking = MATCH_SIDES[model]
+    if profiled(model, 'tile').get(entity_id) is None:
+        abort(404)
+    limit = max(1, min(request.args.get('limit', app.config['MATCH_LIMIT'], type=int), app.config['MAX_PAGE_SIZE']))
+    endpoint = 'show_venue' if other is Venue else 'show_artist'
+    rows = matches_for(model, entity_id, request.args.get('same_city') == '1', limit)
+    return jsonify({key: entity_id, 'matches': [
+        {other_key: other_id, 'name': name, 'city': city, 'state': state, 'image_link': image_link,
+         'url': url_for(endpoint, **{other_key: other_id}), 'shared_genres': match.shared_genres,
+         'same_city': match.same_city, 'score': match.score}
+        for match, other_id, name, city, state, image_link in rows]})
+
+
+@app.route('/api/venues/<int:venue_id>/matches')
+def api_venue_matches(venue_id):
+    return api_matches(Venue, venue_id)
+
+
+@app.route('/api/artists/<int:artist_id>/matches')
+def api_artist_matches(artist_id):
+    return api_matches(Artist, artist_id)
+
+
+@app.route('/api/venues/<int:venue_id>/free-slots')
+def api_venue_free_slots(venue_id):
+    # ?from=<date or time>&days=7&min_minutes=60
+    try:
+        start = parse_time(request.args['from']) if 'from' in request.args else \
+            datetime.combine(datetime.today().date(), datetime.min.time())
+        days = min(max(int(request.args.get('days', 7)), 1), 31)
+        min_minutes = int(request.args.get('min_minutes', 0))
+    except (ValueError, OverflowError):
+        abort(400)
+    if profiled(Venue, 'tile').get(venue_id) is None:
+        abort(404)
+    end = start + timedelta(days=days)
+    slots = free_slots(venue_id, start, end, min_minutes)
+    return Response(api_json({'venue_id': venue_id, 'from': start, 'to': end,
+                              'free': [{'start': slot_start, 'end': slot_end} for slot_start, slot_end in slots]}),
+                    mimetype='application/json')
 
 
 @app.errorhandler(404)
@@ -0,0 +1,306 @@
+"""Reproducible benchmark for every route in app.py.
+
+Seeds a database with synthetic venues, artists and shows, drives each
+route through the Flask test client and reports latency percentiles, query
+counts and peak Python memory per route.
+
+    $ python benchmark.py --database sqlite:///bench.db --shows 100000
+    $ python benchmark.py --database postgresql://localhost/fyyur_bench --shows 1000000 --json bench.json
+
+The same --seed and --shows always produce the same data set. The target
+database is dropped and recreated unless --reuse is given.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+import warnings
+from datetime import date, datetime, timedelta
+
+CITIES = [
+    ('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('Oakland', 'CA'), ('New York', 'NY'),
+    ('Brooklyn', 'NY'), ('Austin', 'TX'), ('Houston', 'TX'), ('Chicago', 'IL'), ('Seattle', 'WA'),
+    ('Portland', 'OR'), ('Nashville', 'TN'), ('Memphis', 'TN'), ('New Orleans', 'LA'),
+    ('Denver', 'CO'), ('Atlanta', 'GA'), ('Boston', 'MA'), ('Philadelphia', 'PA'),
+    ('Detroit', 'MI'), ('Minneapolis', 'MN'), ('Miami', 'FL'), ('Portland', 'ME'),
+]
+WORDS = [
+    'Musical', 'Hop', 'Dueling', 'Pianos', 'Park', 'Square', 'Live', 'Music', 'Coffee', 'Guns',
+    'Petals', 'Matt', 'Quevedo', 'Wild', 'Sax', 'Band', 'Blue', 'Velvet', 'Electric', 'Owl',
+    'Lantern', 'Echo', 'Hall', 'Room', 'Garden', 'Social', 'Club', 'Tavern', 'Riot', 'Honey',
+]
+BATCH = 10000
+
+
+def seed_rows(shows, seed):
+    """Yields ('venues'|'artists'|'shows', row) tuples for a seeded data set."""
+    from forms import VenueForm
+    genres = [value for value, label in VenueForm.genres.kwargs['choices']]
+    rng = random.Random(seed)
+    venue_count = max(10, shows // 20)
+    artist_count = max(10, shows // 10)
+    now = datetime(2026, 1, 1)
+
+    def name(words):
+        return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+    def genre_list():
+        # a few genres per entity, skewed towards the popular ones
+        return sorted(set(genres[min(int(rng.expovariate(0.25)), len(genres) - 1)] for _ in range(rng.randint(1, 4))))
+
+    for venue_id in range(1, venue_count + 1):
+        city, state = rng.choice(CITIES)
+        yield 'venues', {
+            'venue_id': venue_id, 'name': 'The %s %d' % (name(2), venue_id), 'city': city, 'state': state,
+            'address': '%d %s St' % (rng.randint(1, 9999), rng.choice(WORDS)),
+            'phone': '%03d-%03d-%04d' % (rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+            'genres': genre_list(), 'website': 'https://example.com/venues/%d' % venue_id,
+            'image_link': 'https://example.com/venues/%d.jpg' % venue_id,
+            'facebook_link': 'https://www.facebook.com/venue%d' % venue_id,
+            'seeking_talent': rng.random() < 0.3, 'seeking_description': None,
+        }
+    for artist_id in range(1, artist_count + 1):
+        city, state = rng.choice(CITIES)
+        yield 'artists', {
+            'artist_id': artist_id, 'name': '%s %d' % (name(rng.randint(1, 3)), artist_id), 'city': city,
+            'state': state, 'phone': '%03d-%03d-%04d' % (rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+            'genres': genre_list(), 'image_link': 'https://example.com/artists/%d.jpg' % artist_id,
+            'facebook_link': 'https://www.facebook.com/artist%d' % artist_id,
+            'seeking_venue': rng.random() < 0.3, 'seeking_description': None,
+        }
+    booked = set()
+    for show_id in range(1, shows + 1):
+        # two years of history, one year of bookings, hour-long evening slots; a few venues and artists are much busier
+        start = now + timedelta(days=rng.randint(-730, 365), hours=rng.randint(18, 23))
+        venue_id = min(int(rng.paretovariate(1.2)), venue_count) if rng.random() < 0.2 else rng.randint(1, venue_count)
+        while (venue_id, start) in booked:
+            # venues are never double booked
+            start = now + timedelta(days=rng.randint(-730, 365), hours=rng.randint(18, 23))
+            venue_id = rng.randint(1, venue_count)
+        booked.add((venue_id, start))
+        yield 'shows', {
+            'show_id': show_id, 'start_time': start, 'duration': 60, 'venue_id': venue_id,
+            'artist_id': rng.randint(1, artist_count),
+        }
+
+
+def seed_database(fyyur, shows, seed):
+    db = fyyur.db
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        db.session.commit()
+    db.drop_all()
+    db.create_all()
+    tables = {'venues': fyyur.Venue.__table__, 'artists': fyyur.Artist.__table__, 'shows': fyyur.Shows.__table__}
+    pending = {name: [] for name in tables}
+
+    def flush(last):
+        # tables are in dependency order: a batch of shows goes in only after
+        # the venues and artists it refers to, which foreign keys now check
+        for name in tables:
+            if pending[name]:
+                db.session.execute(tables[name].insert(), pending[name])
+                pending[name] = []
+            if name == last:
+                break
+
+    started = time.time()
+    for name, row in seed_rows(shows, seed):
+        pending[name].append(row)
+        if len(pending[name]) >= BATCH:
+            flush(name)
+    flush('shows')
+    if db.engine.dialect.name == 'postgresql':
+        for name, table in tables.items():
+            pk = list(table.primary_key)[0].name
+            db.session.execute("SELECT setval(pg_get_serial_sequence('%s', '%s'), (SELECT max(%s) FROM %s))" % (name, pk, pk, name))
+    db.session.commit()
+    fyyur.refresh_venue_areas()
+    fyyur.refresh_genre_facets()
+    fyyur.refresh_show_counters()
+    fyyur.refresh_matches()
+    fyyur.geocode_venues()
+    db.session.execute('ANALYZE')
+    db.session.commit()
+    print('seeded %d shows in %.1fs' % (shows, time.time() - started))
+
+
+def scenarios(fyyur):
+    """(endpoint, method, make_request) for every benchmarked route.
+
+    make_request() runs before timing starts and returns (url, form data);
+    it may write throwaway rows, e.g. a venue for delete_venue to remove.
+    """
+    db = fyyur.db
+    busy_venue = db.session.query(fyyur.Shows.venue_id).group_by(fyyur.Shows.venue_id).\
+        order_by(db.func.count().desc()).limit(1).scalar() or 1
+    busy_artist = db.session.query(fyyur.Shows.artist_id).group_by(fyyur.Shows.artist_id).\
+        order_by(db.func.count().desc()).limit(1).scalar() or 1
+    recent_shows = fyyur.encode_cursor([max(fyyur.latest_show_id() - 20, 0)])
+    venue_form = {'name': 'Bench Venue', 'city': 'Oakland', 'state': 'CA', 'address': '1 Bench St',
+                  'phone': '510-555-0100', 'genres': ['Jazz', 'Folk'], 'facebook_link': 'https://www.facebook.com/bench',
+                  'website': 'https://example.com', 'image_link': 'https://example.com/bench.jpg', 'seeking_talent': 'True',
+                  'seeking_description': ''}
+    artist_form = {'name': 'Bench Artist', 'city': 'Oakland', 'state': 'CA', 'phone': '510-555-0101',
+                   'genres': ['Jazz'], 'facebook_link': 'https://www.facebook.com/benchartist',
+                   'image_link': 'https://example.com/bench-artist.jpg', 'seeking_venue': 'False', 'seeking_description': ''}
+
+    def throwaway(model, **values):
+        entity = model(**values)
+        db.session.add(entity)
+        db.session.commit()
+        return db.inspect(entity).identity[0]
+
+    doomed_shows = itertools.count()
+
+    def doomed(model, key, other_key, other_id, shows=100):
+        # a throwaway venue or artist with shows, so deleting it exercises the cascade
+        entity_id = throwaway(model, name='Doomed', city='Oakland', state='CA')
+        db.session.add_all([fyyur.Shows(**{key: entity_id, other_key: other_id, 'duration': 60,
+                                           'start_time': datetime(2040, 1, 1) + timedelta(hours=next(doomed_shows))})
+                            for _ in range(shows)])
+        db.session.commit()
+        return entity_id
+
+    new_shows = itertools.count()
+
+    def get(url):
+        return lambda: (url, None)
+
+    def post(url, data):
+        return lambda: (url, data)
+
+    return [
+        ('index', 'GET', get('/')),
+        ('autocomplete', 'GET', get('/autocomplete?q=the')),
+        ('venues', 'GET', get('/venues')),
+        ('artists', 'GET', get('/artists')),
+        ('shows', 'GET', get('/shows')),
+        ('show_venue', 'GET', get('/venues/%d' % busy_venue)),
+        ('show_artist', 'GET', get('/artists/%d' % busy_artist)),
+        ('browse_venues', 'GET', get('/venues/browse?genre=Jazz&state=CA')),
+        ('browse_artists', 'GET', get('/artists/browse?genre=Rock&genre=Folk&seeking=1')),
+        ('search_venues', 'POST', post('/venues/search', {'search_term': 'music'})),
+        ('search_artists', 'POST', post('/artists/search', {'search_term': 'petal'})),
+        ('search_shows', 'POST', post('/shows/search', {'search_term': 'hop'})),
+        ('create_venue_form', 'GET', get('/venues/create')),
+        ('create_artist_form', 'GET', get('/artists/create')),
+        ('create_shows', 'GET', get('/shows/create')),
+        ('edit_venue', 'GET', get('/venues/%d/edit' % busy_venue)),
+        ('edit_artist', 'GET', get('/artists/%d/edit' % busy_artist)),
+        ('create_venue_submission', 'POST', post('/venues/create', venue_form)),
+        ('create_artist_submission', 'POST', post('/artists/create', artist_form)),
+        ('create_show_submission', 'POST', lambda: ('/shows/create', {
+            'artist_id': busy_artist, 'venue_id': busy_venue, 'duration': 60,
+            'start_time': (datetime(2030, 1, 1) + timedelta(hours=next(new_shows))).strftime('%Y-%m-%d %H:%M:%S')})),
+        ('edit_venue_submission', 'POST', post('/venues/%d/edit' % busy_venue, dict(venue_form, name='Bench Venue Edited'))),
+        ('edit_artist_submission', 'POST', post('/artists/%d/edit' % busy_artist, dict(artist_form, name='Bench Artist Edited'))),
+        ('delete_venue', 'DELETE', lambda: ('/venues/%d' % doomed(fyyur.Venue, 'venue_id', 'artist_id', busy_artist), None)),
+        ('delete_artist', 'DELETE', lambda: ('/artists/%d/delete' % doomed(fyyur.Artist, 'artist_id', 'venue_id', busy_venue), None)),
+        ('api_shows', 'GET', get('/api/shows?format=ndjson')),
+        ('api_new_shows', 'GET', get('/api/shows/new?cursor=%s' % recent_shows)),
+        ('api_venue', 'GET', get('/api/venues/%d' % busy_venue)),
+        ('api_artist', 'GET', get('/api/artists/%d' % busy_artist)),
+        ('api_venue_matches', 'GET', get('/api/venues/%d/matches' % busy_venue)),
+        ('api_artist_matches', 'GET', get('/api/artists/%d/matches' % busy_artist)),
+        ('venues_near_page', 'GET', get('/venues/near?city=San Francisco&state=CA&days=30')),
+        ('api_calendar', 'GET', get('/api/calendar?window=next-7-days')),
+        ('api_calendar_filtered', 'GET', get('/api/calendar?from=%s&days=14&state=CA&genre=Jazz' % date.today())),
+        ('api_venues_near', 'GET', get('/api/venues/near?lat=37.77&lng=-122.42&radius_km=50&limit=20')),
+        ('api_venue_free_slots', 'GET', get('/api/venues/%d/free-slots?from=%s&days=7' % (busy_venue, date.today()))),
+        ('cache_stats', 'GET', get('/cache/stats')),
+        ('metrics', 'GET', get('/metrics')),
+    ]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(fyyur, requests):
+    client = fyyur.app.test_client()
+    results = []
+    benchmarked = set()
+    for endpoint, method, make_request in scenarios(fyyur):
+        benchmarked.add(endpoint)
+        timings, queries, statuses = [], [], {}
+        for _ in range(requests):
+            url, data = make_request()
+            started = time.perf_counter()
+            response = client.open(url, method=method, data=data)
+            timings.append((time.perf_counter() - started) * 1000)
+            match = re.search(r'desc="(\d+) queries"', response.headers.get('Server-Timing', ''))
+            queries.append(int(match.group(1)) if match else 0)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            response.close()
+        url, data = make_request()
+        tracemalloc.start()
+        client.open(url, method=method, data=data).close()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({
+            'endpoint': endpoint, 'method': method,
+            'p50_ms': percentile(timings, 0.5), 'p95_ms': percentile(timings, 0.95), 'p99_ms': percentile(timings, 0.99),
+            'queries': max(queries), 'peak_kib': peak / 1024.0,
+            'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        })
+    missing = sorted(rule.endpoint for rule in fyyur.app.url_map.iter_rules()
+                     if rule.endpoint != 'static' and rule.endpoint not in benchmarked)
+    return results, missing
+
+
+def report(results, missing):
+    print('%-26s %-6s %9s %9s %9s %7s %10s  %s' % ('endpoint', 'method', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'peak KiB', 'statuses'))
+    for row in results:
+        print('%-26s %-6s %9.2f %9.2f %9.2f %7d %10.1f  %s' % (
+            row['endpoint'], row['method'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['queries'], row['peak_kib'],
+            ' '.join('%s:%d' % item for item in row['statuses'].items())))
+    if missing:
+        print('not benchmarked: %s' % ', '.join(missing))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database', default='sqlite:///bench.db', help='SQLAlchemy URL of a scratch database')
+    parser.add_argument('--shows', type=int, default=1000, help='number of shows to generate (1k to 1M)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=50, help='timed requests per route')
+    parser.add_argument('--cache-backend', default='null', help="CACHE_BACKEND to benchmark with (default: caching off)")
+    parser.add_argument('--reuse', action='store_true', help='keep the existing data instead of reseeding')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show application logs and warnings')
+    args = parser.parse_args(argv)
+
+    os.environ['DATABASE_URL'] = args.database
+    import app as fyyur
+    from cache import create_cache
+    # failing routes are reported as 500s rather than aborting the run
+    fyyur.app.config.update(DEBUG=False, PROPAGATE_EXCEPTIONS=False, WTF_CSRF_ENABLED=False, CACHE_BACKEND=args.cache_backend)
+    fyyur.page_cache = create_cache(fyyur.app.config)
+    if not args.verbose:
+        fyyur.app.logger.setLevel(logging.CRITICAL)
+        warnings.simplefilter('ignore')
+    with fyyur.app.app_context():
+        if not args.reuse:
+            seed_database(fyyur, args.shows, args.seed)
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+            results, missing = run(fyyur, args.requests)
+    report(results, missing)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump({'shows': args.shows, 'seed': args.seed, 'database': fyyur.db.engine.dialect.name,
+                       'requests': args.requests, 'results': results, 'missing': missing}, out, indent=2)
+    return 1 if missing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+class LRUCache(object):
+    # In-process cache: least recently used entries are evicted once
+    # max_entries is reached and every entry expires after ttl seconds.
+    # Namespace generations live outside the LRU so they are never evicted.
+
+    def __init__(self, max_entries=2048, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (value, time.time() + (ttl or self.ttl))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def generation(self, name):
+        with self.lock:
+            return self.generations.get(name, 0)
+
+    def bump(self, name):
+        with self.lock:
+            self.generations[name] = self.generations.get(name, 0) + 1
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisCache(object):
+    # Shared cache for multi-worker deployments; any Redis-compatible server
+    # works. Requires the optional redis package.
+
+    def __init__(self, url, ttl=300, prefix='fyyur:'):
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value.encode('utf-8'), ex=ttl or self.ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def generation(self, name):
+        return int(self.client.get(self.prefix + 'generation:' + name) or 0)
+
+    def bump(self, name):
+        self.client.incr(self.prefix + 'generation:' + name)
+
+    def __len__(self):
+        return self.client.dbsize()
+
+
+class NullCache(object):
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def generation(self, name):
+        return 0
+
+    def bump(self, name):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class Cache(object):
+    # Counts hits and misses per key kind, the part of the key before the
+    # first ':' (venue, artist, venues, tiles, ...).
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        kind = key.split(':', 1)[0]
+        if value is None:
+            self.misses[kind] += 1
+        else:
+            self.hits[kind] += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        # ttl overrides the backend's CACHE_TTL for this entry
+        self.backend.set(key, value, ttl)
+
+    def delete(self, *keys):
+        self.backend.delete(*keys)
+
+    def namespace(self, name):
+        # keys built on a namespace are all invalidated at once by bump(name)
+        return '%s:%d' % (name, self.backend.generation(name))
+
+    def bump(self, *names):
+        for name in names:
+            self.backend.bump(name)
+
+    def stats(self):
+        kinds = sorted(set(self.hits) | set(self.misses))
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': sum(self.hits.values()),
+            'misses': sum(self.misses.values()),
+            'kinds': {kind: {'hits': self.hits[kind], 'misses': self.misses[kind]} for kind in kinds},
+        }
+
+
+def create_cache(config):
+    backend = config.get('CACHE_BACKEND', 'lru')
+    ttl = config.get('CACHE_TTL', 300)
+    if backend == 'lru':
+        return Cache(LRUCache(config.get('CACHE_MAX_ENTRIES', 2048), ttl))
+    if backend == 'redis':
+        return Cache(RedisCache(config['CACHE_REDIS_URL'], ttl))
+    if backend == 'null':
+        return Cache(NullCache())
+    raise ValueError('Unknown CACHE_BACKEND %r' % backend)
@@ -0,0 +1,122 @@
+import queue
+import select
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+
+class Subscription(object):
+    # one connected client; dropped when it falls SHOW_FEED_QUEUE_SIZE events
+    # behind, so a slow reader cannot hold memory or block publishers
+
+    def __init__(self, size):
+        self.events = queue.Queue(size)
+        self.dropped = False
+
+    def next(self, timeout):
+        # the next event, or None after timeout seconds without one
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ShowFeed(object):
+    # Publish/subscribe for show changes, as preformatted JSON strings.
+    # With SHOW_FEED_BROKER = 'local' an event reaches the subscribers of the
+    # process that published it. With 'postgres' it is sent with NOTIFY on
+    # SHOW_FEED_CHANNEL, and each process runs one thread that LISTENs on its
+    # own connection (SHOW_FEED_LISTEN_URL, or the primary) and hands every
+    # notification to its subscribers, so all workers see all changes.
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.broker = app.config.get('SHOW_FEED_BROKER', 'local')
+        self.channel = app.config.get('SHOW_FEED_CHANNEL', 'fyyur_shows')
+        self.listen_url = app.config.get('SHOW_FEED_LISTEN_URL') or app.config['SQLALCHEMY_DATABASE_URI']
+        self.max_clients = app.config.get('SHOW_FEED_MAX_CLIENTS', 100)
+        self.queue_size = app.config.get('SHOW_FEED_QUEUE_SIZE', 100)
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def active(self):
+        # whether anyone may receive what is published
+        return self.broker == 'postgres' or bool(self.subscribers)
+
+    def publish(self, payload):
+        if self.broker == 'postgres':
+            self.db.engine.execute(text('SELECT pg_notify(:channel, :payload)').execution_options(autocommit=True),
+                                   channel=self.channel, payload=payload)
+        else:
+            self.deliver(payload)
+
+    def deliver(self, payload):
+        with self.lock:
+            self.published += 1
+            for subscription in list(self.subscribers):
+                try:
+                    subscription.events.put_nowait(payload)
+                except queue.Full:
+                    subscription.dropped = True
+                    self.subscribers.discard(subscription)
+                    self.dropped += 1
+
+    def subscribe(self):
+        # None when SHOW_FEED_MAX_CLIENTS are already connected
+        if self.broker == 'postgres':
+            self.start_listener()
+        with self.lock:
+            if len(self.subscribers) >= self.max_clients:
+                return None
+            subscription = Subscription(self.queue_size)
+            self.subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def start_listener(self):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, name='show-feed-listener', daemon=True)
+                self.listener.start()
+
+    def listen(self):
+        engine = create_engine(self.listen_url, poolclass=NullPool)
+        while True:
+            try:
+                pooled = engine.raw_connection()
+                try:
+                    connection = pooled.connection
+                    connection.autocommit = True
+                    connection.cursor().execute('LISTEN %s' % self.channel)
+                    while True:
+                        if select.select([connection], [], [], 30)[0]:
+                            connection.poll()
+                            while connection.notifies:
+                                self.deliver(connection.notifies.pop(0).payload)
+                finally:
+                    pooled.close()
+            except Exception as error:
+                # keep the thread alive through restarts and failovers
+                self.app.logger.warning('show feed listener lost its connection, retrying: %s', getattr(error, 'orig', error))
+                time.sleep(5)
+
+    def metrics(self):
+        # Prometheus text exposition format
+        return ['# HELP fyyur_show_feed_subscribers Clients connected to /shows/feed.',
+                '# TYPE fyyur_show_feed_subscribers gauge',
+                'fyyur_show_feed_subscribers %d' % len(self.subscribers),
+                '# HELP fyyur_show_feed_events_total Show events handed to this process\'s subscribers.',
+                '# TYPE fyyur_show_feed_events_total counter',
+                'fyyur_show_feed_events_total %d' % self.published,
+                '# HELP fyyur_show_feed_dropped_total Subscribers disconnected for falling behind.',
+                '# TYPE fyyur_show_feed_dropped_total counter',
+                'fyyur_show_feed_dropped_total %d' % self.dropped]
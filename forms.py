@@ -1,7 +1,14 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, NumberRange, Optional
+
+from config import MAX_SHOW_DURATION, SHOW_DURATION
+
+
+def coerce_bool(value):
+    # the Yes/No selects post 'True'/'False'; edit forms are prefilled with bools
+    return value in (True, 'True', 'true', '1', 'yes', 'y')
 
 
 class ShowForm(Form):
@@ -16,6 +23,11 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default=datetime.today()
     )
+    duration = IntegerField(
+        'duration',
+        validators=[Optional(), NumberRange(min=1, max=MAX_SHOW_DURATION)],
+        default=SHOW_DURATION
+    )
 
 
 class VenueForm(Form):
@@ -123,11 +135,11 @@ class VenueForm(Form):
     )
     seeking_talent = SelectField(
         choices=[(True, 'Yes'), (False, 'No')],
-        validators=[]
+        validators=[], coerce=coerce_bool, default=False
     )
 
     seeking_description = StringField(
-        'website', validators=[URL()]
+        'seeking_description'
     )
 
 
@@ -232,9 +244,9 @@ class ArtistForm(Form):
     )
     seeking_venue = SelectField(
         choices=[(True, 'Yes'), (False, 'No')],
-        validators=[]
+        validators=[], coerce=coerce_bool, default=False
     )
 
     seeking_description = StringField(
-        'website', validators=[URL()]
+        'seeking_description'
     )
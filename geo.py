@@ -0,0 +1,131 @@
+import csv
+import io
+import math
+from collections import namedtuple
+
+EARTH_RADIUS_KM = 6371.0
+
+# Venues are bucketed into a fixed grid of GRID_DEGREES x GRID_DEGREES
+# cells (about 11 km north-south), stored as integer (grid_y, grid_x)
+# columns under one B-tree index. A box query becomes a range on grid_y and
+# grid_x, so nearby venues are found without PostGIS or a full scan.
+GRID_DEGREES = 0.1
+
+Box = namedtuple('Box', 'min_lat min_lng max_lat max_lng')
+
+# (state, city) -> centroid for the largest US cities, the offline stand-in
+# for a geocoder. GEO_CENTROIDS_PATH adds or overrides entries from a CSV
+# with state, city, latitude and longitude columns.
+CITY_CENTROIDS = {
+    ('AK', 'anchorage'): (61.2181, -149.9003),
+    ('AL', 'birmingham'): (33.5186, -86.8104),
+    ('AZ', 'mesa'): (33.4152, -111.8315),
+    ('AZ', 'phoenix'): (33.4484, -112.0740),
+    ('AZ', 'tucson'): (32.2226, -110.9747),
+    ('CA', 'anaheim'): (33.8366, -117.9143),
+    ('CA', 'bakersfield'): (35.3733, -119.0187),
+    ('CA', 'fresno'): (36.7378, -119.7871),
+    ('CA', 'long beach'): (33.7701, -118.1937),
+    ('CA', 'los angeles'): (34.0522, -118.2437),
+    ('CA', 'oakland'): (37.8044, -122.2712),
+    ('CA', 'riverside'): (33.9533, -117.3962),
+    ('CA', 'sacramento'): (38.5816, -121.4944),
+    ('CA', 'san diego'): (32.7157, -117.1611),
+    ('CA', 'san francisco'): (37.7749, -122.4194),
+    ('CA', 'san jose'): (37.3382, -121.8863),
+    ('CA', 'santa ana'): (33.7455, -117.8677),
+    ('CO', 'aurora'): (39.7294, -104.8319),
+    ('CO', 'colorado springs'): (38.8339, -104.8214),
+    ('CO', 'denver'): (39.7392, -104.9903),
+    ('DC', 'washington'): (38.9072, -77.0369),
+    ('FL', 'jacksonville'): (30.3322, -81.6557),
+    ('FL', 'miami'): (25.7617, -80.1918),
+    ('FL', 'orlando'): (28.5383, -81.3792),
+    ('FL', 'tampa'): (27.9506, -82.4572),
+    ('GA', 'atlanta'): (33.7490, -84.3880),
+    ('HI', 'honolulu'): (21.3069, -157.8583),
+    ('IL', 'chicago'): (41.8781, -87.6298),
+    ('IN', 'indianapolis'): (39.7684, -86.1581),
+    ('KS', 'wichita'): (37.6872, -97.3301),
+    ('KY', 'louisville'): (38.2527, -85.7585),
+    ('LA', 'new orleans'): (29.9511, -90.0715),
+    ('MA', 'boston'): (42.3601, -71.0589),
+    ('MD', 'baltimore'): (39.2904, -76.6122),
+    ('ME', 'portland'): (43.6591, -70.2568),
+    ('MI', 'detroit'): (42.3314, -83.0458),
+    ('MN', 'minneapolis'): (44.9778, -93.2650),
+    ('MN', 'saint paul'): (44.9537, -93.0900),
+    ('MO', 'kansas city'): (39.0997, -94.5786),
+    ('MO', 'st. louis'): (38.6270, -90.1994),
+    ('NC', 'charlotte'): (35.2271, -80.8431),
+    ('NC', 'raleigh'): (35.7796, -78.6382),
+    ('NE', 'omaha'): (41.2565, -95.9345),
+    ('NJ', 'newark'): (40.7357, -74.1724),
+    ('NM', 'albuquerque'): (35.0844, -106.6504),
+    ('NV', 'henderson'): (36.0395, -114.9817),
+    ('NV', 'las vegas'): (36.1699, -115.1398),
+    ('NY', 'brooklyn'): (40.6782, -73.9442),
+    ('NY', 'buffalo'): (42.8864, -78.8784),
+    ('NY', 'new york'): (40.7128, -74.0060),
+    ('OH', 'cleveland'): (41.4993, -81.6944),
+    ('OH', 'cincinnati'): (39.1031, -84.5120),
+    ('OH', 'columbus'): (39.9612, -82.9988),
+    ('OK', 'oklahoma city'): (35.4676, -97.5164),
+    ('OK', 'tulsa'): (36.1540, -95.9928),
+    ('OR', 'portland'): (45.5152, -122.6784),
+    ('PA', 'philadelphia'): (39.9526, -75.1652),
+    ('PA', 'pittsburgh'): (40.4406, -79.9959),
+    ('TN', 'memphis'): (35.1495, -90.0490),
+    ('TN', 'nashville'): (36.1627, -86.7816),
+    ('TX', 'arlington'): (32.7357, -97.1081),
+    ('TX', 'austin'): (30.2672, -97.7431),
+    ('TX', 'corpus christi'): (27.8006, -97.3964),
+    ('TX', 'dallas'): (32.7767, -96.7970),
+    ('TX', 'el paso'): (31.7619, -106.4850),
+    ('TX', 'fort worth'): (32.7555, -97.3308),
+    ('TX', 'houston'): (29.7604, -95.3698),
+    ('TX', 'san antonio'): (29.4241, -98.4936),
+    ('UT', 'salt lake city'): (40.7608, -111.8910),
+    ('VA', 'virginia beach'): (36.8529, -75.9780),
+    ('WA', 'seattle'): (47.6062, -122.3321),
+    ('WI', 'milwaukee'): (43.0389, -87.9065),
+}
+
+
+def normalize_place(value):
+    return ' '.join((value or '').lower().split())
+
+
+class CentroidGeocoder(object):
+
+    def __init__(self, path=None):
+        self.centroids = dict(CITY_CENTROIDS)
+        if path:
+            with io.open(path, newline='', encoding='utf-8') as source:
+                for row in csv.DictReader(source):
+                    self.centroids[(row['state'].strip().upper(), normalize_place(row['city']))] = \
+                        (float(row['latitude']), float(row['longitude']))
+
+    def locate(self, city, state):
+        # (latitude, longitude) of the city's centroid, or None
+        return self.centroids.get(((state or '').strip().upper(), normalize_place(city)))
+
+
+def grid_cell(latitude, longitude):
+    return int(math.floor(latitude / GRID_DEGREES)), int(math.floor(longitude / GRID_DEGREES))
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    # haversine
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    # smallest latitude/longitude box holding the circle; does not wrap
+    # around the antimeridian
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    lng_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * max(math.cos(math.radians(latitude)), 0.01)))
+    return Box(max(latitude - lat_delta, -90.0), max(longitude - lng_delta, -180.0),
+               min(latitude + lat_delta, 90.0), min(longitude + lng_delta, 180.0))
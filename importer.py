@@ -0,0 +1,268 @@
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+
+from werkzeug.datastructures import MultiDict
+
+
+class ImportKind(object):
+    # How to load one kind of record: the model whose table receives the
+    # rows, the form whose validators every record must pass, the columns
+    # taken from the validated form and the references (e.g. a show's
+    # artist) that may be given by id or by name.
+
+    def __init__(self, model, form_class, columns, references=()):
+        self.model = model
+        self.form_class = form_class
+        self.columns = columns
+        self.references = references
+        self.table = model.__table__
+        self.primary_key = list(self.table.primary_key)[0].name
+
+
+class Reference(object):
+
+    def __init__(self, column, name_field, model, id_attr, name_attr):
+        self.column = column
+        self.name_field = name_field
+        self.model = model
+        self.id_attr = id_attr
+        self.name_attr = name_attr
+
+
+class RejectedRecord(Exception):
+    pass
+
+
+def read_records(path, fmt):
+    # yields (record, error) one line at a time so files of any size stream
+    with io.open(path, newline='', encoding='utf-8') as source:
+        if fmt == 'csv':
+            for record in csv.DictReader(source):
+                yield record, None
+        else:
+            for line in source:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as error:
+                    yield None, 'invalid JSON: %s' % error
+                    continue
+                if isinstance(record, dict):
+                    yield record, None
+                else:
+                    yield None, 'expected a JSON object'
+
+
+def formdata(record):
+    data = MultiDict()
+    for key, value in record.items():
+        if value is None or value == '':
+            continue
+        if key == 'genres' and isinstance(value, str):
+            # CSV cells hold comma separated genres
+            value = [genre.strip() for genre in value.split(',') if genre.strip()]
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                data.add(key, str(item))
+        else:
+            data.add(key, str(value))
+    return data
+
+
+def pg_array(values):
+    return '{' + ','.join('"%s"' % value.replace('\\', '\\\\').replace('"', '\\"') for value in values) + '}'
+
+
+def copy_value(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return pg_array(value)
+    return value
+
+
+class BulkLoader(object):
+    # Streams a CSV or NDJSON file into one table in batches. Each record is
+    # validated with the same form the web handlers use. Rejected records go
+    # to <file>.rejects with their errors. After every committed batch the
+    # number of records consumed is written to <file>.checkpoint, so an
+    # interrupted load can carry on with resume=True. check_rows(rows) yields
+    # errors (or None) for each valid row of a batch before it is inserted,
+    # before_commit(rows) runs inside each batch's transaction, after_batch(rows)
+    # once it committed.
+
+    def __init__(self, db, kind, batch_size=5000, progress=None, check_rows=None, before_commit=None, after_batch=None):
+        self.db = db
+        self.kind = kind
+        self.batch_size = batch_size
+        self.progress = progress or (lambda message: None)
+        self.check_rows = check_rows
+        self.before_commit = before_commit
+        self.after_batch = after_batch
+        self.use_copy = db.engine.dialect.driver == 'psycopg2'
+
+    def run(self, path, fmt, resume=False):
+        checkpoint_path = path + '.checkpoint'
+        state = {'records': 0, 'loaded': 0, 'rejected': 0}
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint:
+                state = json.load(checkpoint)
+            self.progress('resuming after record %d' % state['records'])
+        skip = state['records']
+        started = time.time()
+        explicit_ids = False
+        batch = []
+        with io.open(path + '.rejects', 'a' if resume else 'w', encoding='utf-8') as rejects_file:
+            for number, (record, error) in enumerate(read_records(path, fmt), 1):
+                if number <= skip:
+                    continue
+                batch.append((number, record, error))
+                if len(batch) >= self.batch_size:
+                    explicit_ids |= self.load_batch(batch, state, rejects_file)
+                    self.save_checkpoint(checkpoint_path, state)
+                    self.report(state, skip, started)
+                    batch = []
+            if batch:
+                explicit_ids |= self.load_batch(batch, state, rejects_file)
+                self.save_checkpoint(checkpoint_path, state)
+        if explicit_ids:
+            self.sync_sequence()
+        self.report(state, skip, started)
+        return state
+
+    def report(self, state, skip, started):
+        elapsed = max(time.time() - started, 1e-6)
+        self.progress('%d records, %d loaded, %d rejected (%.0f records/s)' % (
+            state['records'], state['loaded'], state['rejected'], (state['records'] - skip) / elapsed))
+
+    def save_checkpoint(self, checkpoint_path, state):
+        with open(checkpoint_path + '.tmp', 'w') as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    def load_batch(self, batch, state, rejects_file):
+        references = self.resolve_references([record for number, record, error in batch if record])
+        valid = []
+        for number, record, error in batch:
+            try:
+                if error:
+                    raise RejectedRecord(error)
+                valid.append((number, record, self.row(record, references)))
+            except RejectedRecord as rejection:
+                self.reject(rejects_file, state, number, record, rejection.args[0])
+        rows = []
+        checked = self.check_rows([row for number, record, row in valid]) if self.check_rows else [None] * len(valid)
+        for (number, record, row), errors in zip(valid, checked):
+            if errors:
+                self.reject(rejects_file, state, number, record, errors)
+            else:
+                rows.append(row)
+        explicit_ids = any(self.kind.primary_key in row for row in rows)
+        try:
+            self.insert(rows)
+            if self.before_commit:
+                self.before_commit(rows)
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            raise
+        state['records'] = batch[-1][0]
+        state['loaded'] += len(rows)
+        if self.after_batch:
+            self.after_batch(rows)
+        return explicit_ids
+
+    def reject(self, rejects_file, state, number, record, errors):
+        rejects_file.write(json.dumps({'record': number, 'data': record, 'errors': errors}) + '\n')
+        state['rejected'] += 1
+
+    def row(self, record, references):
+        form = self.kind.form_class(formdata=formdata(record), meta={'csrf': False})
+        if not form.validate():
+            raise RejectedRecord(form.errors)
+        row = {column: form[column].data for column in self.kind.columns}
+        key = record.get(self.kind.primary_key)
+        if key not in (None, ''):
+            row[self.kind.primary_key] = self.integer(key, self.kind.primary_key)
+        for reference in self.kind.references:
+            value = record.get(reference.column)
+            if value not in (None, ''):
+                row[reference.column] = self.integer(value, reference.column)
+                if row[reference.column] not in references[reference.column]:
+                    raise RejectedRecord({reference.column: ['%s does not exist' % value]})
+            else:
+                name = record.get(reference.name_field)
+                ids = references[reference.name_field].get(name, [])
+                if len(ids) != 1:
+                    raise RejectedRecord({reference.name_field: [
+                        '%r matches %d rows' % (name, len(ids)) if ids else '%r does not exist' % name]})
+                row[reference.column] = ids[0]
+        return row
+
+    def integer(self, value, field):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise RejectedRecord({field: ['not an integer']})
+
+    def resolve_references(self, records):
+        # one query per reference and batch, never one per record
+        resolved = {}
+        for reference in self.kind.references:
+            ids, names = set(), set()
+            for record in records:
+                value = record.get(reference.column)
+                if value not in (None, ''):
+                    try:
+                        ids.add(int(value))
+                    except (TypeError, ValueError):
+                        pass
+                elif record.get(reference.name_field):
+                    names.add(record[reference.name_field])
+            found = set()
+            if ids:
+                found = {row[0] for row in self.db.session.query(reference.id_attr).filter(reference.id_attr.in_(ids))}
+            by_name = {}
+            if names:
+                for key, name in self.db.session.query(reference.id_attr, reference.name_attr).filter(reference.name_attr.in_(names)):
+                    by_name.setdefault(name, []).append(key)
+            resolved[reference.column] = found
+            resolved[reference.name_field] = by_name
+        return resolved
+
+    def insert(self, rows):
+        # rows with and without explicit ids need different column lists
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for columns, group in groups.items():
+            if self.use_copy:
+                self.copy(columns, group)
+            else:
+                self.db.session.execute(self.kind.table.insert(), group)
+
+    def copy(self, columns, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([copy_value(row[column]) for column in columns])
+        buffer.seek(0)
+        cursor = self.db.session.connection().connection.cursor()
+        cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (self.kind.table.name, ', '.join(columns)), buffer)
+
+    def sync_sequence(self):
+        if self.db.engine.dialect.name != 'postgresql':
+            return
+        table, key = self.kind.table.name, self.kind.primary_key
+        self.db.session.execute("SELECT setval(pg_get_serial_sequence('%s', '%s'), (SELECT max(%s) FROM %s))" % (table, key, key, table))
+        self.db.session.commit()
@@ -0,0 +1,102 @@
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_whitespace = re.compile(r'\s+')
+# collapse expanded IN lists and VALUES rows so they share a shape
+_repeated_params = re.compile(r'\((\s*(\?|%\([^)]*\)s|%s|:\w+)\s*,?)+\)')
+
+
+def statement_shape(statement):
+    return _repeated_params.sub('(?)', _whitespace.sub(' ', statement).strip())
+
+
+class EndpointStats(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.slowest_seconds = 0.0
+
+
+class SQLInstrumentation(object):
+    # Records query count, total database time and the slowest statement of
+    # every request. They are sent back in a Server-Timing header and summed
+    # per endpoint for the /metrics endpoint. A statement shape running more
+    # than SQL_REPEAT_WARNING times in one request is logged as a likely N+1.
+
+    def __init__(self, app):
+        self.app = app
+        self.repeat_warning = app.config.get('SQL_REPEAT_WARNING', 10)
+        self.endpoints = {}
+        self.lock = threading.Lock()
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def start_request(self):
+        g.sql_started = time.time()
+        g.sql_queries = 0
+        g.sql_seconds = 0.0
+        g.sql_slowest = (0.0, None)
+        g.sql_shapes = Counter()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.time())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.time() - conn.info['query_start_time'].pop()
+        if not has_request_context() or 'sql_started' not in g:
+            return
+        g.sql_queries += 1
+        g.sql_seconds += elapsed
+        if elapsed > g.sql_slowest[0]:
+            g.sql_slowest = (elapsed, statement)
+        shape = statement_shape(statement)
+        g.sql_shapes[shape] += 1
+        if g.sql_shapes[shape] == self.repeat_warning + 1:
+            self.app.logger.warning('Possible N+1: statement ran more than %d times in %s %s: %s',
+                                    self.repeat_warning, request.method, request.path, shape[:500])
+
+    def finish_request(self, response):
+        if 'sql_started' not in g:
+            return response
+        slowest_seconds, slowest_statement = g.sql_slowest
+        timings = [
+            'db;dur=%.2f;desc="%d queries"' % (g.sql_seconds * 1000, g.sql_queries),
+            'app;dur=%.2f' % ((time.time() - g.sql_started) * 1000),
+        ]
+        if slowest_statement:
+            desc = statement_shape(slowest_statement)[:120].replace('"', "'").encode('ascii', 'replace').decode('ascii')
+            timings.append('db-slowest;dur=%.2f;desc="%s"' % (slowest_seconds * 1000, desc))
+        response.headers.add('Server-Timing', ', '.join(timings))
+        with self.lock:
+            stats = self.endpoints.setdefault(request.endpoint or 'unknown', EndpointStats())
+            stats.requests += 1
+            stats.queries += g.sql_queries
+            stats.db_seconds += g.sql_seconds
+            stats.slowest_seconds = max(stats.slowest_seconds, slowest_seconds)
+        return response
+
+    def metrics(self):
+        # Prometheus text exposition format
+        lines = []
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            for name, help_text, kind, value in (
+                    ('fyyur_requests_total', 'Requests served.', 'counter', lambda s: s.requests),
+                    ('fyyur_db_queries_total', 'SQL statements executed.', 'counter', lambda s: s.queries),
+                    ('fyyur_db_seconds_total', 'Time spent executing SQL.', 'counter', lambda s: s.db_seconds),
+                    ('fyyur_db_slowest_seconds', 'Slowest single SQL statement.', 'gauge', lambda s: s.slowest_seconds)):
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s %s' % (name, kind))
+                for endpoint, stats in endpoints:
+                    lines.append('%s{endpoint="%s"} %s' % (name, endpoint, value(stats)))
+        return lines
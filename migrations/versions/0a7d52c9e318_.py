@@ -0,0 +1,100 @@
+"""partition shows by month and add shows_archive
+
+Revision ID: 0a7d52c9e318
+Revises: f1c93b6e4a27
+Create Date: 2026-10-18 15:20:37.661482
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a7d52c9e318'
+down_revision = 'f1c93b6e4a27'
+branch_labels = None
+depends_on = None
+
+NO_OVERLAP = ("ALTER TABLE {0} ADD CONSTRAINT {0}_venue_no_overlap EXCLUDE USING gist "
+              "(venue_id WITH =, tsrange(start_time, start_time + duration * interval '1 minute') WITH &&)")
+
+
+def create_show_indexes():
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_start_time_show_id', 'shows', ['start_time', 'show_id'], unique=False)
+
+
+def upgrade():
+    op.create_table('shows_archive',
+    sa.Column('show_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=True),
+    sa.Column('venue_id', sa.Integer(), nullable=True),
+    sa.Column('start_time', sa.DateTime(), nullable=True),
+    sa.Column('duration', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artists.artist_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['venues.venue_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('show_id')
+    )
+    op.create_index('ix_shows_archive_venue_id_start_time', 'shows_archive', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_archive_artist_id_start_time', 'shows_archive', ['artist_id', 'start_time'], unique=False)
+
+    # the partition key has to be part of the primary key, and so NOT NULL
+    op.execute("""
+        CREATE TABLE shows_partitioned (
+            show_id integer NOT NULL DEFAULT nextval('shows_show_id_seq'),
+            artist_id integer REFERENCES artists (artist_id),
+            venue_id integer REFERENCES venues (venue_id),
+            start_time timestamp NOT NULL,
+            duration integer NOT NULL DEFAULT 120,
+            PRIMARY KEY (show_id, start_time)
+        ) PARTITION BY RANGE (start_time)""")
+    op.execute('CREATE TABLE shows_default PARTITION OF shows_partitioned DEFAULT')
+    op.execute("""
+        DO $$
+        DECLARE
+            month date;
+            name text;
+        BEGIN
+            FOR month IN SELECT generate_series(date_trunc('month', coalesce(min(start_time), now())),
+                                                date_trunc('month', now()) + interval '12 months',
+                                                interval '1 month')::date FROM shows LOOP
+                name := 'shows_y' || to_char(month, 'YYYY"m"MM');
+                EXECUTE format('CREATE TABLE %I PARTITION OF shows_partitioned FOR VALUES FROM (%L) TO (%L)',
+                               name, month, month + interval '1 month');
+                EXECUTE format($sql$ALTER TABLE %I ADD CONSTRAINT %I EXCLUDE USING gist
+                               (venue_id WITH =, tsrange(start_time, start_time + duration * interval '1 minute') WITH &&)$sql$,
+                               name, name || '_venue_no_overlap');
+            END LOOP;
+        END $$""")
+    op.execute(NO_OVERLAP.format('shows_default'))
+    op.execute('INSERT INTO shows_partitioned (show_id, artist_id, venue_id, start_time, duration) '
+               'SELECT show_id, artist_id, venue_id, start_time, duration FROM shows')
+    op.execute('ALTER SEQUENCE shows_show_id_seq OWNED BY shows_partitioned.show_id')
+    op.execute('DROP TABLE shows')
+    op.execute('ALTER TABLE shows_partitioned RENAME TO shows')
+    op.execute('ALTER TABLE shows RENAME CONSTRAINT shows_partitioned_pkey TO shows_pkey')
+    create_show_indexes()
+
+
+def downgrade():
+    op.execute("""
+        CREATE TABLE shows_unpartitioned (
+            show_id integer NOT NULL DEFAULT nextval('shows_show_id_seq') PRIMARY KEY,
+            artist_id integer REFERENCES artists (artist_id),
+            venue_id integer REFERENCES venues (venue_id),
+            start_time timestamp,
+            duration integer NOT NULL DEFAULT 120
+        )""")
+    op.execute('INSERT INTO shows_unpartitioned (show_id, artist_id, venue_id, start_time, duration) '
+               'SELECT show_id, artist_id, venue_id, start_time, duration FROM shows '
+               'UNION ALL SELECT show_id, artist_id, venue_id, start_time, duration FROM shows_archive')
+    op.execute('ALTER SEQUENCE shows_show_id_seq OWNED BY shows_unpartitioned.show_id')
+    op.execute('DROP TABLE shows')
+    op.execute('ALTER TABLE shows_unpartitioned RENAME TO shows')
+    op.execute('ALTER TABLE shows RENAME CONSTRAINT shows_unpartitioned_pkey TO shows_pkey')
+    op.execute(NO_OVERLAP.format('shows'))
+    create_show_indexes()
+    op.drop_index('ix_shows_archive_artist_id_start_time', table_name='shows_archive')
+    op.drop_index('ix_shows_archive_venue_id_start_time', table_name='shows_archive')
+    op.drop_table('shows_archive')
@@ -0,0 +1,29 @@
+"""version and updated_at on venues and artists
+
+Revision ID: 3c5f81d2e9a0
+Revises: 7b2e9f04c6d1
+Create Date: 2026-10-18 16:48:09.713550
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5f81d2e9a0'
+down_revision = '7b2e9f04c6d1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venues', 'artists'):
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), server_default=sa.text("timezone('utc', now())"),
+                                       nullable=False))
+
+
+def downgrade():
+    for table in ('venues', 'artists'):
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'version')
@@ -0,0 +1,48 @@
+"""venue-artist matches
+
+Revision ID: 5e8d3b17a2c4
+Revises: 3c5f81d2e9a0
+Create Date: 2026-10-18 19:12:37.204816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '5e8d3b17a2c4'
+down_revision = '3c5f81d2e9a0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('matches',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('shared_genres', postgresql.ARRAY(sa.String()), nullable=False),
+    sa.Column('same_city', sa.Boolean(), nullable=False),
+    sa.Column('score', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artists.artist_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['venues.venue_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('venue_id', 'artist_id')
+    )
+    op.create_index('ix_matches_venue_id_score', 'matches', ['venue_id', 'score'], unique=False)
+    op.create_index('ix_matches_artist_id_score', 'matches', ['artist_id', 'score'], unique=False)
+    op.create_index('ix_artists_state_city', 'artists', ['state', 'city'], unique=False)
+    # same scoring as match_row with the default MATCH_SAME_CITY_BONUS of 2;
+    # flask refresh-matches recomputes with the configured one
+    op.execute("INSERT INTO matches (venue_id, artist_id, shared_genres, same_city, score) "
+               "SELECT venue_id, artist_id, shared, close, cardinality(shared) + CASE WHEN close THEN 2 ELSE 0 END "
+               "FROM (SELECT v.venue_id, a.artist_id, "
+               "ARRAY(SELECT unnest(v.genres) INTERSECT SELECT unnest(a.genres) ORDER BY 1) AS shared, "
+               "coalesce(trim(v.city), '') <> '' AND lower(trim(v.city)) = lower(trim(a.city)) AS close "
+               "FROM venues v JOIN artists a ON a.state = v.state AND a.genres && v.genres "
+               "WHERE v.seeking_talent AND a.seeking_venue) AS paired")
+
+
+def downgrade():
+    op.drop_index('ix_artists_state_city', table_name='artists')
+    op.drop_index('ix_matches_artist_id_score', table_name='matches')
+    op.drop_index('ix_matches_venue_id_score', table_name='matches')
+    op.drop_table('matches')
@@ -0,0 +1,45 @@
+"""show counters on venues and artists
+
+Revision ID: 7b2e9f04c6d1
+Revises: 0a7d52c9e318
+Create Date: 2026-10-18 16:05:52.290118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2e9f04c6d1'
+down_revision = '0a7d52c9e318'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('counter_watermarks',
+    sa.Column('name', sa.String(length=40), nullable=False),
+    sa.Column('value', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.execute("INSERT INTO counter_watermarks (name, value) VALUES ('shows', localtimestamp)")
+    for table, key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        for column in ('upcoming_show_count', 'past_show_count', 'show_count'):
+            op.add_column(table, sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+        op.execute("""
+            UPDATE {0} SET upcoming_show_count = counts.upcoming, past_show_count = counts.past, show_count = counts.total
+            FROM (SELECT {1}, count(*) FILTER (WHERE start_time > w.value) AS upcoming,
+                         count(*) FILTER (WHERE start_time <= w.value) AS past, count(*) AS total
+                  FROM (SELECT {1}, start_time FROM shows UNION ALL SELECT {1}, start_time FROM shows_archive) AS history,
+                       counter_watermarks w WHERE w.name = 'shows' GROUP BY {1}) AS counts
+            WHERE {0}.{1} = counts.{1}""".format(table, key))
+        op.create_index('ix_%s_activity' % table, table, [sa.text('(-upcoming_show_count)'), sa.text('(-show_count)'), 'name', key],
+                        unique=False)
+
+
+def downgrade():
+    for table in ('venues', 'artists'):
+        op.drop_index('ix_%s_activity' % table, table_name=table)
+        for column in ('show_count', 'past_show_count', 'upcoming_show_count'):
+            op.drop_column(table, column)
+    op.drop_table('counter_watermarks')
@@ -0,0 +1,33 @@
+"""venue coordinates and grid cells
+
+Revision ID: 8d41c6fa0b93
+Revises: 5e8d3b17a2c4
+Create Date: 2026-10-18 19:48:21.660417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41c6fa0b93'
+down_revision = '5e8d3b17a2c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # run flask geocode-venues afterwards to place existing venues
+    op.add_column('venues', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('venues', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('venues', sa.Column('grid_y', sa.Integer(), nullable=True))
+    op.add_column('venues', sa.Column('grid_x', sa.Integer(), nullable=True))
+    op.create_index('ix_venues_grid', 'venues', ['grid_y', 'grid_x'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_venues_grid', table_name='venues')
+    op.drop_column('venues', 'grid_x')
+    op.drop_column('venues', 'grid_y')
+    op.drop_column('venues', 'longitude')
+    op.drop_column('venues', 'latitude')
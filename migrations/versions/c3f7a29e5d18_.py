@@ -0,0 +1,40 @@
+"""cascade show deletes from venues and artists
+
+Revision ID: c3f7a29e5d18
+Revises: 8d41c6fa0b93
+Create Date: 2026-10-18 21:12:05.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f7a29e5d18'
+down_revision = '8d41c6fa0b93'
+branch_labels = None
+depends_on = None
+
+# the partitioned shows table still carries the foreign keys it was created
+# with as shows_partitioned, so drop them by what they reference
+DROP_SHOW_FOREIGN_KEYS = """
+    DO $$
+    DECLARE
+        name text;
+    BEGIN
+        FOR name IN SELECT conname FROM pg_constraint WHERE conrelid = 'shows'::regclass AND contype = 'f' LOOP
+            EXECUTE format('ALTER TABLE shows DROP CONSTRAINT %I', name);
+        END LOOP;
+    END $$"""
+
+
+def upgrade():
+    op.execute(DROP_SHOW_FOREIGN_KEYS)
+    op.create_foreign_key('shows_artist_id_fkey', 'shows', 'artists', ['artist_id'], ['artist_id'], ondelete='CASCADE')
+    op.create_foreign_key('shows_venue_id_fkey', 'shows', 'venues', ['venue_id'], ['venue_id'], ondelete='CASCADE')
+
+
+def downgrade():
+    op.execute(DROP_SHOW_FOREIGN_KEYS)
+    op.create_foreign_key('shows_artist_id_fkey', 'shows', 'artists', ['artist_id'], ['artist_id'])
+    op.create_foreign_key('shows_venue_id_fkey', 'shows', 'venues', ['venue_id'], ['venue_id'])
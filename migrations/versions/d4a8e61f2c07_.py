@@ -0,0 +1,34 @@
+"""venue_areas summary table
+
+Revision ID: d4a8e61f2c07
+Revises: b71e4d09c3a8
+Create Date: 2026-10-18 13:26:05.331948
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8e61f2c07'
+down_revision = 'b71e4d09c3a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('venue_areas',
+    sa.Column('state', sa.String(length=120), nullable=False),
+    sa.Column('city', sa.String(length=120), nullable=False),
+    sa.Column('venue_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('state', 'city')
+    )
+    op.create_index('ix_venues_state_city', 'venues', ['state', 'city'], unique=False)
+    op.execute("INSERT INTO venue_areas (state, city, venue_count) "
+               "SELECT coalesce(state, ''), coalesce(city, ''), count(*) FROM venues "
+               "GROUP BY coalesce(state, ''), coalesce(city, '')")
+
+
+def downgrade():
+    op.drop_index('ix_venues_state_city', table_name='venues')
+    op.drop_table('venue_areas')
@@ -0,0 +1,41 @@
+"""genre GIN indexes and genre_facets counts
+
+Revision ID: e52b07a9d1f4
+Revises: d4a8e61f2c07
+Create Date: 2026-10-18 14:02:41.517203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e52b07a9d1f4'
+down_revision = 'd4a8e61f2c07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('genre_facets',
+    sa.Column('entity', sa.String(length=10), nullable=False),
+    sa.Column('state', sa.String(length=120), nullable=False),
+    sa.Column('seeking', sa.Boolean(), nullable=False),
+    sa.Column('genre', sa.String(length=120), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('entity', 'state', 'seeking', 'genre')
+    )
+    op.create_index('ix_venues_genres', 'venues', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_artists_genres', 'artists', ['genres'], unique=False, postgresql_using='gin')
+    for entity, seeking in (('venues', 'seeking_talent'), ('artists', 'seeking_venue')):
+        op.execute("INSERT INTO genre_facets (entity, state, seeking, genre, count) "
+                   "SELECT '{0}', coalesce(state, ''), coalesce({1}, false), genre, count(*) "
+                   "FROM (SELECT DISTINCT {2}, state, {1}, unnest(genres) AS genre FROM {0}) AS tagged "
+                   "GROUP BY coalesce(state, ''), coalesce({1}, false), genre".format(
+                       entity, seeking, entity[:-1] + '_id'))
+
+
+def downgrade():
+    op.drop_index('ix_artists_genres', table_name='artists')
+    op.drop_index('ix_venues_genres', table_name='venues')
+    op.drop_table('genre_facets')
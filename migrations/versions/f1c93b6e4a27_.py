@@ -0,0 +1,32 @@
+"""show durations and venue double-booking exclusion constraint
+
+Revision ID: f1c93b6e4a27
+Revises: e52b07a9d1f4
+Create Date: 2026-10-18 14:41:12.084519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c93b6e4a27'
+down_revision = 'e52b07a9d1f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('shows', sa.Column('duration', sa.Integer(), server_default='120', nullable=False))
+    # fails if the venue already has overlapping shows; list them with
+    # SELECT a.show_id, b.show_id FROM shows a JOIN shows b ON a.venue_id = b.venue_id
+    # AND a.show_id < b.show_id AND a.start_time < b.start_time + b.duration * interval '1 minute'
+    # AND b.start_time < a.start_time + a.duration * interval '1 minute'
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.execute("ALTER TABLE shows ADD CONSTRAINT shows_venue_no_overlap EXCLUDE USING gist "
+               "(venue_id WITH =, tsrange(start_time, start_time + duration * interval '1 minute') WITH &&)")
+
+
+def downgrade():
+    op.execute('ALTER TABLE shows DROP CONSTRAINT shows_venue_no_overlap')
+    op.drop_column('shows', 'duration')
@@ -0,0 +1,91 @@
+import threading
+import time
+
+from flask import has_request_context
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that also counts checkouts, how long they waited for a free
+    # connection and how many gave up after pool_timeout.
+
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.stats_lock = threading.Lock()
+
+    def _do_get(self):
+        started = time.time()
+        timed_out = False
+        try:
+            return QueuePool._do_get(self)
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            with self.stats_lock:
+                self.checkouts += 1
+                self.timeouts += timed_out
+                self.wait_seconds += time.time() - started
+
+
+def engine_options(config):
+    # create_engine() options for every bind. SQLite keeps the pools
+    # Flask-SQLAlchemy picks for it.
+    if not make_url(config['SQLALCHEMY_DATABASE_URI']).drivername.startswith('postgres'):
+        return {}
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING'], 'pool_recycle': config['DB_POOL_RECYCLE']}
+    if config['DB_POOL'] == 'null':
+        # every checkout opens a new connection; leave pooling to pgbouncer
+        options['poolclass'] = NullPool
+    else:
+        options.update(poolclass=TimedQueuePool, pool_size=config['DB_POOL_SIZE'],
+                       max_overflow=config['DB_MAX_OVERFLOW'], pool_timeout=config['DB_POOL_TIMEOUT'])
+    return options
+
+
+class PoolMonitor(object):
+    # Applies DB_STATEMENT_TIMEOUT to every transaction a request opens, with
+    # SET LOCAL so it never outlives the transaction: that keeps it safe
+    # behind pgbouncer in transaction pooling mode, and leaves CLI jobs and
+    # migrations without a timeout. Also exposes the pools' state for the
+    # /metrics endpoint.
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.statement_timeout = app.config.get('DB_STATEMENT_TIMEOUT', 0)
+        if self.statement_timeout:
+            event.listen(Engine, 'begin', self.set_statement_timeout)
+
+    def set_statement_timeout(self, connection):
+        if has_request_context() and connection.dialect.name == 'postgresql':
+            connection.execute('SET LOCAL statement_timeout = %d' % self.statement_timeout)
+
+    def pools(self):
+        binds = [(None, 'primary')] + [(key, key) for key in self.app.config.get('REPLICA_BINDS', [])]
+        return [(name, self.db.get_engine(self.app, bind=key).pool) for key, name in binds]
+
+    def metrics(self):
+        # Prometheus text exposition format; only pools that keep connections report
+        pools = [(name, pool) for name, pool in self.pools() if isinstance(pool, QueuePool)]
+        lines = []
+        for metric, help_text, kind, value in (
+                ('fyyur_db_pool_size', 'Connections kept open by the pool.', 'gauge', lambda pool: pool.size()),
+                ('fyyur_db_pool_checked_out', 'Connections currently checked out.', 'gauge', lambda pool: pool.checkedout()),
+                ('fyyur_db_pool_overflow', 'Connections open beyond the pool size.', 'gauge', lambda pool: max(pool.overflow(), 0)),
+                ('fyyur_db_pool_checkouts_total', 'Connection checkouts.', 'counter', lambda pool: getattr(pool, 'checkouts', 0)),
+                ('fyyur_db_pool_timeouts_total', 'Checkouts that gave up after DB_POOL_TIMEOUT.', 'counter',
+                 lambda pool: getattr(pool, 'timeouts', 0)),
+                ('fyyur_db_pool_wait_seconds_total', 'Time spent waiting for a free connection.', 'counter',
+                 lambda pool: getattr(pool, 'wait_seconds', 0.0))):
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s %s' % (metric, kind))
+            for name, pool in pools:
+                lines.append('%s{bind="%s"} %s' % (metric, name, value(pool)))
+        return lines
@@ -0,0 +1,137 @@
+import threading
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, exc, orm
+
+# Seconds the replica's replay is behind the primary; 0 while it has caught
+# up with everything it received, so an idle primary does not look like lag.
+PG_LAG_QUERY = ("SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+
+def use_primary(view):
+    # for read-only routes that must see the latest committed data, such as
+    # forms about to be edited; list it under @app.route
+    view.use_primary = True
+    return view
+
+
+class RoutingSession(SignallingSession):
+    # Reads go to the replica ReplicaRouter picked for the current request,
+    # if any. Flushes, and everything outside a request, use the primary.
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_request_context():
+            replica = g.get('db_replica')
+            if replica is not None:
+                return replica.engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class Replica(object):
+
+    def __init__(self, key, engine):
+        self.key = key
+        self.engine = engine
+        self.lag = None
+        self.healthy = False
+        self.checked = 0.0
+        self.reads = 0
+
+
+class ReplicaRouter(object):
+    # Sends GET and HEAD requests to a replica bind (REPLICA_BINDS) whose
+    # replication lag is at most REPLICA_MAX_LAG seconds, measured at most
+    # every REPLICA_LAG_CHECK_INTERVAL seconds per process. With no replica
+    # fit to serve, reads fall back to the primary. A client whose request
+    # committed a write reads from the primary for REPLICA_STICKY_SECONDS
+    # afterwards, remembered in its session cookie, so it always sees its
+    # own writes.
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.keys = app.config.get('REPLICA_BINDS', [])
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', 5)
+        self.check_interval = app.config.get('REPLICA_LAG_CHECK_INTERVAL', 2)
+        self.sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 10)
+        self.replicas = None
+        self.primary_reads = 0
+        self.turn = 0
+        self.lock = threading.Lock()
+        app.before_request(self.route_request)
+        app.after_request(self.remember_writes)
+        event.listen(db.session, 'after_commit', self.committed)
+
+    def route_request(self):
+        g.db_replica = None
+        if not self.keys or request.method not in ('GET', 'HEAD'):
+            return
+        view = self.app.view_functions.get(request.endpoint)
+        if getattr(view, 'use_primary', False) or session.get('primary_until', 0) > time.time():
+            replica = None
+        else:
+            replica = self.pick()
+        with self.lock:
+            if replica is None:
+                self.primary_reads += 1
+            else:
+                replica.reads += 1
+        g.db_replica = replica
+
+    def pick(self):
+        if self.replicas is None:
+            with self.lock:
+                if self.replicas is None:
+                    self.replicas = [Replica(key, self.db.get_engine(self.app, bind=key)) for key in self.keys]
+        now = time.time()
+        for replica in self.replicas:
+            if now - replica.checked >= self.check_interval:
+                replica.checked = now
+                self.check(replica)
+        fit = [replica for replica in self.replicas if replica.healthy and replica.lag <= self.max_lag]
+        if not fit:
+            return None
+        with self.lock:
+            self.turn += 1
+            return fit[self.turn % len(fit)]
+
+    def check(self, replica):
+        try:
+            with replica.engine.connect() as connection:
+                replica.lag = float(connection.execute(PG_LAG_QUERY).scalar()) \
+                    if replica.engine.dialect.name == 'postgresql' else 0.0
+            replica.healthy = True
+        except exc.DBAPIError as error:
+            self.app.logger.warning('replica %s is unavailable, reading from the primary: %s', replica.key, error.orig)
+            replica.healthy = False
+
+    def committed(self, db_session):
+        if has_request_context():
+            g.db_wrote = True
+
+    def remember_writes(self, response):
+        if self.keys and g.get('db_wrote'):
+            session['primary_until'] = time.time() + self.sticky_seconds
+        return response
+
+    def metrics(self):
+        # Prometheus text exposition format
+        lines = ['# HELP fyyur_db_reads_total GET and HEAD requests by the database they read from.',
+                 '# TYPE fyyur_db_reads_total counter',
+                 'fyyur_db_reads_total{bind="primary"} %d' % self.primary_reads]
+        replicas = self.replicas or []
+        lines += ['fyyur_db_reads_total{bind="%s"} %d' % (replica.key, replica.reads) for replica in replicas]
+        lines += ['# HELP fyyur_replica_lag_seconds Replication lag at the last check.',
+                  '# TYPE fyyur_replica_lag_seconds gauge']
+        lines += ['fyyur_replica_lag_seconds{bind="%s"} %s' % (replica.key, replica.lag if replica.healthy else 'NaN')
+                  for replica in replicas]
+        return lines
@@ -0,0 +1,242 @@
+import bisect
+import re
+import threading
+
+# Mirrors pg_trgm's default similarity threshold so both backends agree.
+SIMILARITY_THRESHOLD = 0.3
+
+_words = re.compile(r'\w+', re.UNICODE)
+
+
+def trigrams(text):
+    # same padding rules as pg_trgm: two spaces before and one after each word
+    grams = set()
+    for word in _words.findall((text or '').lower()):
+        padded = '  ' + word + ' '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(left, right):
+    if not left or not right:
+        return 0.0
+    return len(left & right) / float(len(left | right))
+
+
+class TrigramIndex(object):
+    # In-process inverted trigram index used when the database has no pg_trgm
+    # (SQLite test databases). Lookups only touch rows sharing a trigram with
+    # the search term instead of scanning every name.
+
+    def __init__(self):
+        self.postings = {}
+        self.names = {}
+        self.grams = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self, rows):
+        with self.lock:
+            self.postings.clear()
+            self.names.clear()
+            self.grams.clear()
+            for key, name in rows:
+                self._add(key, name)
+            self.loaded = True
+
+    def add(self, key, name):
+        with self.lock:
+            self._discard(key)
+            self._add(key, name)
+
+    def discard(self, key):
+        with self.lock:
+            self._discard(key)
+
+    def _add(self, key, name):
+        grams = trigrams(name)
+        self.names[key] = (name or '').lower()
+        self.grams[key] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(key)
+
+    def _discard(self, key):
+        for gram in self.grams.pop(key, ()):
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+        self.names.pop(key, None)
+
+    def search(self, term, limit=None):
+        # returns [(key, score)] best first; substring hits always qualify,
+        # like the name ILIKE '%term%' OR name % term filter used on Postgres
+        needle = (term or '').strip().lower()
+        grams = trigrams(needle)
+        with self.lock:
+            if not grams:
+                return []
+            candidates = set()
+            for gram in grams:
+                candidates.update(self.postings.get(gram, ()))
+            hits = []
+            for key in candidates:
+                score = similarity(grams, self.grams[key])
+                if score >= SIMILARITY_THRESHOLD or needle in self.names[key]:
+                    hits.append((key, score))
+        hits.sort(key=lambda hit: (-hit[1], self.names.get(hit[0], ''), hit[0]))
+        return hits[:limit] if limit else hits
+
+
+class TagIndex(object):
+    # In-process tag -> keys index, the fallback for array containment
+    # queries (genres @> ARRAY[...]) on databases without array columns.
+
+    def __init__(self):
+        self.keys = {}
+        self.tags = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self, rows):
+        with self.lock:
+            self.keys.clear()
+            self.tags.clear()
+            for key, tags in rows:
+                self._add(key, tags)
+            self.loaded = True
+
+    def add(self, key, tags):
+        with self.lock:
+            self._discard(key)
+            self._add(key, tags)
+
+    def discard(self, key):
+        with self.lock:
+            self._discard(key)
+
+    def _add(self, key, tags):
+        self.tags[key] = set(tags or ())
+        for tag in self.tags[key]:
+            self.keys.setdefault(tag, set()).add(key)
+
+    def _discard(self, key):
+        for tag in self.tags.pop(key, ()):
+            keys = self.keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys[tag]
+
+    def containing(self, tags):
+        # keys tagged with every one of tags, smallest posting list first
+        with self.lock:
+            postings = sorted((self.keys.get(tag, set()) for tag in tags), key=len)
+            if not postings:
+                return set()
+            return set(postings[0]).intersection(*postings[1:])
+
+
+def normalize(text):
+    return ' '.join(_words.findall((text or '').lower()))
+
+
+class PrefixIndex(object):
+    # In-process prefix index for autocompletion: sorted arrays searched with
+    # bisect. Level 0 holds whole names, level 1 the name from its 2nd, 3rd,
+    # ... word on (up to max_words words in), so "pet" finds "Guns N Petals"
+    # after names that start with it. Holds at most max_names names; further
+    # adds are ignored until the next load. A load may run while writes keep
+    # arriving: changes made after begin_load() are replayed on top of it.
+
+    def __init__(self, max_names=None, max_words=4):
+        self.max_names = max_names
+        self.max_words = max_words
+        self.levels = ([], [])
+        self.names = {}
+        self.loaded = False
+        self.loaded_at = 0.0
+        self.journal = None
+        self.lock = threading.Lock()
+
+    def entries(self, key, name):
+        words = normalize(name).split(' ')
+        yield 0, (' '.join(words), key)
+        for start in range(1, min(len(words), self.max_words)):
+            yield 1, (' '.join(words[start:]), key)
+
+    def begin_load(self):
+        with self.lock:
+            self.journal = []
+
+    def abort_load(self):
+        # after a failed load; changes are no longer journalled
+        with self.lock:
+            self.journal = None
+
+    def load(self, rows, loaded_at):
+        # rows: (key, name); built outside the lock so lookups carry on
+        names = {}
+        levels = ([], [])
+        for key, name in rows:
+            if self.max_names is not None and len(names) >= self.max_names:
+                break
+            names[key] = name
+            for level, entry in self.entries(key, name):
+                levels[level].append(entry)
+        for level in levels:
+            level.sort()
+        with self.lock:
+            self.names, self.levels = names, levels
+            for change in self.journal or ():
+                self._apply(*change)
+            self.journal = None
+            self.loaded = True
+            self.loaded_at = loaded_at
+
+    def add(self, key, name):
+        self._change(key, name)
+
+    def discard(self, key):
+        self._change(key, None)
+
+    def _change(self, key, name):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append((key, name))
+            self._apply(key, name)
+
+    def _apply(self, key, name):
+        old = self.names.pop(key, None)
+        if old is not None:
+            for level, entry in self.entries(key, old):
+                entries = self.levels[level]
+                position = bisect.bisect_left(entries, entry)
+                if position < len(entries) and entries[position] == entry:
+                    del entries[position]
+        if name is None or (self.max_names is not None and len(self.names) >= self.max_names):
+            return
+        self.names[key] = name
+        for level, entry in self.entries(key, name):
+            bisect.insort(self.levels[level], entry)
+
+    def complete(self, prefix, limit):
+        # [(level, key, name)], whole-name matches first, each level in name order
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        found = []
+        seen = set()
+        with self.lock:
+            for level, entries in enumerate(self.levels):
+                position = bisect.bisect_left(entries, (prefix,))
+                while position < len(entries) and len(found) < limit:
+                    text, key = entries[position]
+                    if not text.startswith(prefix):
+                        break
+                    if key not in seen:
+                        seen.add(key)
+                        found.append((level, key, self.names[key]))
+                    position += 1
+        return found